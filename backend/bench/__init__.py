@@ -0,0 +1,24 @@
+"""Load-test and benchmark suite. Run from backend/ so the app modules import as usual.
+
+    # 1. seed a synthetic inventory into DATABASE_URL (SQLite file or a local Postgres)
+    DATABASE_URL=sqlite:///./bench.db python -m bench.seed --reset --servers 100000 --domains 20000 --history 1000000
+
+    # 2. drive the app - in-process by default, or a running server with --url
+    DATABASE_URL=sqlite:///./bench.db python -m bench.run --workload mix --concurrency 32 --duration 30
+
+    # 3. keep the numbers as a baseline, compare later runs against it (exit code 1 on regression)
+    python -m bench.run ... --save-baseline bench/baseline.json
+    python -m bench.run ... --baseline bench/baseline.json
+
+    # list serialization: ORM + pydantic vs. column tuples + orjson, with an output parity check
+    DATABASE_URL=sqlite:///./bench.db python -m bench.serialization --rows 10000 --lists servers finance
+
+    # statements per endpoint at N and 10N rows must match (no N+1); drops every table
+    DATABASE_URL=sqlite:///./queries.db python -m bench.queries --rows 50
+
+bench.run needs httpx. Pass it the same --servers/--groups/--projects counts the database was seeded
+with, so updates and history reads hit existing rows. Queries-per-request come from the
+app's own /metrics, per route - operations sharing a route (list_servers and
+search_servers) report that route's average. Against a multi-worker server they cover
+only the worker that answered the scrape.
+"""
@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import types
+
+import loading
+from bench import seed
+
+# Query-count regression check: seeds DATABASE_URL at --rows and again at 10x that,
+# requests every list and detail endpoint on the in-process app, and fails if any of
+# them runs a different number of SQL statements at the larger size - the sign of a
+# relationship loaded per row (N+1). Drops and recreates every table: point it at a
+# scratch database.
+
+ENDPOINTS = [
+    "/api/servers",
+    "/api/servers?fields=id,ip,group",
+    "/api/servers?q=node",
+    "/api/servers/1",
+    "/api/servers/1?fields=id,ip",
+    "/api/servers/reachability",
+    "/api/domains",
+    "/api/domains?q=alpha",
+    "/api/groups",
+    "/api/projects",
+    "/api/finance",
+    "/api/finance/analytics",
+    "/api/users",
+    "/api/history",
+    "/api/history/server/1",
+    "/api/settings/me",
+    "/api/overview",
+]
+
+def _scale(rows: int):
+    return types.SimpleNamespace(
+        projects=max(1, rows // 100), groups=max(1, rows // 10), servers=rows, domains=rows, finance=rows,
+        history=rows, history_days=30, seed=1, password=seed.BENCH_PASSWORD, reset=True,
+    )
+
+async def _measure(client, http_cache, headers):
+    counts = {}
+    for path in ENDPOINTS:
+        # a cached list would run no entity query at all
+        http_cache.response_cache.clear()
+        with loading.count_queries() as statements:
+            r = await client.get(path, headers=headers)
+        if r.status_code != 200:
+            raise SystemExit(f"GET {path}: {r.status_code} {r.text[:200]}")
+        counts[path] = len(statements)
+    return counts
+
+async def run(rows_list):
+    import httpx
+    import main, http_cache
+
+    results = []
+    for rows in rows_list:
+        await seed.seed(_scale(rows))
+        # ids and users start over after the reset
+        main.token_cache.clear()
+        main.principal_cache.clear()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+            r = await client.post("/api/token", data={"username": seed.BENCH_USER, "password": seed.BENCH_PASSWORD})
+            headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+            await client.get("/api/settings/me", headers=headers)  # principal cached, as after any first request
+            results.append(await _measure(client, http_cache, headers))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.queries", description="Check that no endpoint's SQL statement count grows with the number of rows.")
+    parser.add_argument("--rows", type=int, default=50, help="smaller size; the larger one is 10x")
+    args = parser.parse_args(argv)
+
+    sizes = [args.rows, args.rows * 10]
+    small, large = asyncio.run(run(sizes))
+    print(f"{'endpoint':<36}{sizes[0]:>8}{sizes[1]:>8}")
+    failed = []
+    for path in ENDPOINTS:
+        mark = "" if small[path] == large[path] else "  <- grows with rows"
+        print(f"{path:<36}{small[path]:>8}{large[path]:>8}{mark}")
+        if mark:
+            failed.append(path)
+    if failed:
+        raise SystemExit(f"statement count depends on row count: {', '.join(failed)}")
+    print("statement counts constant")
+
+if __name__ == "__main__":
+    main()
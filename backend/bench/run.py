@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+from bench import seed
+
+# Closed-loop load generator: --concurrency workers each issue one request after another
+# for --duration seconds, picking operations from the chosen workload. Latency is
+# measured client side; statements per request are read from the app's /metrics
+# (http_request_db_statements) before and after the run.
+
+class Op:
+    def __init__(self, name, method, route, request):
+        self.name = name
+        self.method = method
+        self.route = route  # route template, as labelled in /metrics
+        self.request = request  # (client, ctx, rng) -> awaitable response
+
+def _server_id(ctx, rng):
+    return rng.randint(1, ctx.servers)
+
+def _search_term(ctx, rng):
+    kind = rng.random()
+    if kind < 0.4:
+        return seed.server_ip(_server_id(ctx, rng)).rsplit(".", 1)[0]  # ip prefix, ~256 hits
+    if kind < 0.7:
+        return f"group {rng.randint(1, ctx.groups)}"
+    return f"project {rng.randint(1, ctx.projects)}"
+
+OPS = {op.name: op for op in [
+    Op("login", "POST", "/api/token", lambda c, ctx, rng: c.post("/api/token", data={"username": ctx.username, "password": ctx.password})),
+    Op("list_servers", "GET", "/api/servers", lambda c, ctx, rng: c.get("/api/servers", params={"limit": ctx.page_size}, headers=ctx.headers)),
+    Op("list_domains", "GET", "/api/domains", lambda c, ctx, rng: c.get("/api/domains", params={"limit": ctx.page_size}, headers=ctx.headers)),
+    Op("search_servers", "GET", "/api/servers", lambda c, ctx, rng: c.get("/api/servers", params={"q": _search_term(ctx, rng), "limit": ctx.page_size}, headers=ctx.headers)),
+    Op("get_server", "GET", "/api/servers/{id}", lambda c, ctx, rng: c.get(f"/api/servers/{_server_id(ctx, rng)}", headers=ctx.headers)),
+    Op("update_server", "PUT", "/api/servers/{id}", lambda c, ctx, rng: _update_server(c, ctx, rng)),
+    Op("server_history", "GET", "/api/history/{type}/{id}", lambda c, ctx, rng: c.get(f"/api/history/server/{_server_id(ctx, rng)}", headers=ctx.headers)),
+    Op("history_feed", "GET", "/api/history", lambda c, ctx, rng: c.get("/api/history", params={"limit": ctx.page_size}, headers=ctx.headers)),
+]}
+
+def _update_server(client, ctx, rng):
+    id = _server_id(ctx, rng)
+    body = seed.server_row(rng, id, ctx.group_list)
+    # runs replay the same random sequence; keep every update a real change
+    body["comments"] = f"bench update {time.time_ns()}"
+    return client.put(f"/api/servers/{id}", json=body, headers=ctx.headers)
+
+# operation -> weight
+WORKLOADS = {
+    "login": {"login": 1},
+    "list": {"list_servers": 3, "list_domains": 1, "get_server": 2},
+    "search": {"search_servers": 1},
+    "update": {"update_server": 1},
+    "history": {"server_history": 3, "history_feed": 1},
+    "mix": {"list_servers": 20, "list_domains": 5, "get_server": 20, "search_servers": 25, "update_server": 10, "server_history": 15, "history_feed": 4, "login": 1},
+}
+
+class Context:
+    def __init__(self, args):
+        self.username = args.username
+        self.password = args.password
+        self.servers = args.servers
+        self.groups = args.groups
+        self.projects = args.projects
+        self.page_size = args.page_size
+        self.metrics_token = args.metrics_token
+        self.headers = {}
+        self.group_list = []
+
+async def _prepare(client, ctx):
+    r = await client.post("/api/token", data={"username": ctx.username, "password": ctx.password})
+    if r.status_code != 200:
+        raise SystemExit(f"login as {ctx.username} failed ({r.status_code}): {r.text} - seed the database with bench.seed first")
+    ctx.headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    groups = (await client.get("/api/groups", headers=ctx.headers)).json()
+    ctx.group_list = [(g["id"], g["project_id"]) for g in groups] or [(None, None)]
+
+_SAMPLE = re.compile(r'^(\w+)\{(.*)\} ([0-9.eE+-]+)$')
+
+async def _scrape(client, ctx):
+    """{(method, route): (statements, requests)} from the app's /metrics."""
+    headers = {"Authorization": f"Bearer {ctx.metrics_token}"} if ctx.metrics_token else {}
+    r = await client.get("/metrics", headers=headers)
+    if r.status_code != 200:
+        return None
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for line in r.text.splitlines():
+        m = _SAMPLE.match(line)
+        if m and m.group(1) in ("http_request_db_statements_sum", "http_request_db_statements_count"):
+            labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', m.group(2)))
+            totals[labels["method"], labels["route"]][m.group(1).endswith("_count")] = float(m.group(3))
+    return totals
+
+async def _worker(client, ctx, names, weights, rng, deadline, samples):
+    while time.perf_counter() < deadline:
+        op = OPS[rng.choices(names, weights)[0]]
+        started = time.perf_counter()
+        try:
+            status = (await op.request(client, ctx, rng)).status_code
+        except httpx.HTTPError:
+            status = 0
+        if samples is not None:
+            samples[op.name].append((time.perf_counter() - started, status))
+
+async def _drive(client, ctx, workload, concurrency, seconds, samples, base_seed):
+    names, weights = zip(*WORKLOADS[workload].items())
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*[
+        _worker(client, ctx, names, weights, random.Random(base_seed + i), deadline, samples) for i in range(concurrency)
+    ])
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))]
+
+def _summarize(samples, seconds, before, after):
+    ops = {}
+    for name, values in sorted(samples.items()):
+        latencies = sorted(v[0] for v in values)
+        op = OPS[name]
+        qpr = None
+        if before is not None and after is not None:
+            statements = after[op.method, op.route][0] - before[op.method, op.route][0]
+            requests = after[op.method, op.route][1] - before[op.method, op.route][1]
+            qpr = round(statements / requests, 2) if requests else None
+        ops[name] = {
+            "requests": len(values),
+            "errors": sum(1 for _, status in values if not 200 <= status < 400),
+            "rps": round(len(values) / seconds, 1),
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+            "queries_per_request": qpr,
+        }
+    total = sum(o["requests"] for o in ops.values())
+    return {"ops": ops, "total": {"requests": total, "errors": sum(o["errors"] for o in ops.values()), "rps": round(total / seconds, 1)}}
+
+def _print(report):
+    print(f"{'operation':<16}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'q/req':>8}")
+    for name, o in report["ops"].items():
+        qpr = "-" if o["queries_per_request"] is None else f"{o['queries_per_request']:g}"
+        print(f"{name:<16}{o['requests']:>9}{o['errors']:>8}{o['rps']:>9}{o['p50_ms']:>10}{o['p95_ms']:>10}{o['p99_ms']:>10}{qpr:>8}")
+    t = report["total"]
+    print(f"{'total':<16}{t['requests']:>9}{t['errors']:>8}{t['rps']:>9}")
+
+def compare(report, baseline, tolerance):
+    """Returns the regressions of `report` against `baseline`: latency or throughput worse
+    than the tolerance allows, any extra statement per request, or new errors."""
+    problems = []
+    for name, base in baseline["ops"].items():
+        cur = report["ops"].get(name)
+        if cur is None:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if cur[key] > base[key] * (1 + tolerance):
+                problems.append(f"{name}: {key} {cur[key]} > {base[key]} (+{tolerance:.0%})")
+        if cur["rps"] < base["rps"] * (1 - tolerance):
+            problems.append(f"{name}: rps {cur['rps']} < {base['rps']} (-{tolerance:.0%})")
+        if cur["queries_per_request"] is not None and base["queries_per_request"] is not None and cur["queries_per_request"] > base["queries_per_request"] + 0.5:
+            problems.append(f"{name}: queries/request {cur['queries_per_request']} > {base['queries_per_request']}")
+        if cur["errors"] and not base["errors"]:
+            problems.append(f"{name}: {cur['errors']} errors")
+    return problems
+
+async def run(args):
+    ctx = Context(args)
+    app = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=httpx.Limits(max_connections=args.concurrency + 2))
+    else:
+        import main
+        app = main
+        await main.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=args.timeout)
+    try:
+        await _prepare(client, ctx)
+        if args.warmup:
+            await _drive(client, ctx, args.workload, args.concurrency, args.warmup, None, args.seed + 10_000)
+        before = await _scrape(client, ctx)
+        samples = defaultdict(list)
+        started = time.perf_counter()
+        await _drive(client, ctx, args.workload, args.concurrency, args.duration, samples, args.seed)
+        elapsed = time.perf_counter() - started
+        after = await _scrape(client, ctx)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.shutdown()
+    report = _summarize(samples, elapsed, before, after)
+    report["config"] = {
+        "workload": args.workload, "concurrency": args.concurrency, "duration": args.duration,
+        "target": args.url or "in-process", "database": None if args.url else os.environ.get("DATABASE_URL", "").split("@")[-1],
+    }
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description="Drive the API with a synthetic workload and report latency, RPS and queries per request.")
+    parser.add_argument("--url", help="base URL of a running server (default: the app in-process on DATABASE_URL)")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mix")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before the run")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--servers", type=int, default=100_000, help="servers the database was seeded with")
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--username", default=seed.BENCH_USER)
+    parser.add_argument("--password", default=seed.BENCH_PASSWORD)
+    parser.add_argument("--metrics-token", default=os.environ.get("METRICS_TOKEN"))
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="compare against this report; exit 1 on regression")
+    parser.add_argument("--save-baseline", help="write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed latency/throughput drift (default 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    _print(report)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("workload") != args.workload:
+            print(f"note: baseline was recorded with workload {baseline.get('config', {}).get('workload')}")
+        problems = compare(report, baseline, args.tolerance)
+        for problem in problems:
+            print("REGRESSION", problem)
+        if problems:
+            sys.exit(1)
+        print("no regressions against", args.baseline)
+
+if __name__ == "__main__":
+    main()
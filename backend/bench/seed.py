@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import random
+import string
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, text
+
+import database, models, passwords, rollups, search, versions
+
+# Synthetic inventory for bench.run. Rows go in through the same multi-row INSERT ...
+# RETURNING + bulk search-document path as /api/import, so the database ends up exactly
+# as if it had been filled through the API. Same --seed, same data.
+BATCH_SIZE = 1000
+HISTORY_BATCH_SIZE = 5000
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+
+OS = ["Debian 12", "Ubuntu 22.04", "Ubuntu 24.04", "AlmaLinux 9", "Windows Server 2022"]
+HOSTERS = ["Hetzner", "OVH", "DigitalOcean", "Contabo", "Leaseweb", "Vultr", "Linode", "Scaleway"]
+COUNTRIES = ["DE", "FR", "NL", "PL", "UA", "US", "FI", "GB"]
+SERVER_STATUSES = ["Running"] * 8 + ["Stopped", "Maintenance"]
+DOMAIN_STATUSES = ["Active"] * 8 + ["Expired", "Parked"]
+TLDS = ["com", "net", "org", "io", "dev", "com.ua"]
+WORDS = ["alpha", "nova", "orbit", "pixel", "delta", "atlas", "vector", "lumen", "zen", "cobalt", "ember", "quartz"]
+ACCOUNT_STATUSES = ["Active"] * 6 + ["Pending", "Overdue"]
+
+def server_ip(i: int) -> str:
+    return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+def server_row(rng: random.Random, i: int, groups) -> dict:
+    group_id, project_id = rng.choice(groups)
+    return dict(
+        os=rng.choice(OS), ip=server_ip(i), additional_ip="", comments=f"{rng.choice(WORDS)} node {i}",
+        hoster=rng.choice(HOSTERS), status=rng.choice(SERVER_STATUSES), group_id=group_id, project_id=project_id,
+        country=rng.choice(COUNTRIES), ssh_user="root", ssh_port=rng.choice([22, 22, 22, 2222]), cont_pass="",
+        ssh_pass="".join(rng.choices(string.ascii_letters + string.digits, k=16)),
+    )
+
+def domain_row(rng: random.Random, i: int, groups) -> dict:
+    return dict(name=f"{rng.choice(WORDS)}{i}.{rng.choice(TLDS)}", group_id=rng.choice(groups)[0], status=rng.choice(DOMAIN_STATUSES))
+
+def finance_row(rng: random.Random, servers: int, now: datetime) -> dict:
+    return dict(
+        server_id=rng.randint(1, servers), price=round(rng.uniform(3, 250), 2),
+        account_status=rng.choice(ACCOUNT_STATUSES), payment_date=now - timedelta(days=rng.randint(0, 720)),
+    )
+
+def history_row(rng: random.Random, counts: dict, now: datetime, days: int) -> dict:
+    target_type = rng.choices(["server", "domain", "group", "finance"], weights=[6, 2, 1, 1])[0]
+    action = rng.choice(["Created", "Updated", "Updated", "Updated"])
+    old, new = rng.sample(HOSTERS, 2)
+    diff = {"hoster": [old, new]} if action == "Updated" else None
+    return dict(
+        target_id=rng.randint(1, max(1, counts[target_type])), target_type=target_type, action=action,
+        changes=f"hoster: {old} -> {new}" if diff else f"Seeded {target_type}", diff=diff,
+        user=rng.choice([BENCH_USER, "SuperAdmin", "ops"]), timestamp=now - timedelta(seconds=rng.randint(0, days * 86400)),
+    )
+
+async def _insert(db, model, target_type, rows):
+    ids = (await db.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows)).all()
+    if target_type in search.TARGETS:
+        await search.index_new(db, target_type, ids)
+    if model is models.Finance:
+        await rollups.record_new(db, ids)
+    await db.commit()
+    return ids
+
+async def _fill(db, label, model, target_type, total, make):
+    started = time.perf_counter()
+    for i in range(0, total, BATCH_SIZE):
+        await _insert(db, model, target_type, [make(n) for n in range(i + 1, min(total, i + BATCH_SIZE) + 1)])
+    print(f"{label:>10}: {total} rows in {time.perf_counter() - started:.1f}s")
+
+async def seed(args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    if args.reset:
+        await _drop_all()
+    await database.create_all()
+    db = database.new_async_session()
+    try:
+        await versions.seed(db)
+        if await db.scalar(select(models.Server.id).limit(1)) is not None:
+            raise SystemExit("database already holds servers - pass --reset to start from an empty schema")
+
+        projects = await _insert(db, models.Project, "project", [dict(title=f"Project {n}") for n in range(1, args.projects + 1)])
+        group_rows = [
+            dict(title=f"Group {n}", project_id=rng.choice(projects), status=rng.choice(["Enabled"] * 9 + ["Disabled"]), description=f"{rng.choice(WORDS)} team")
+            for n in range(1, args.groups + 1)
+        ]
+        group_ids = await _insert(db, models.Group, "group", group_rows)
+        groups = [(gid, row["project_id"]) for gid, row in zip(group_ids, group_rows)]
+        print(f"{'projects':>10}: {len(projects)}, groups: {len(groups)}")
+
+        await _fill(db, "servers", models.Server, "server", args.servers, lambda n: server_row(rng, n, groups))
+        await _fill(db, "domains", models.Domain, "domain", args.domains, lambda n: domain_row(rng, n, groups))
+        if args.servers:
+            await _fill(db, "finance", models.Finance, "finance", args.finance, lambda n: finance_row(rng, args.servers, now))
+
+        counts = {"server": args.servers, "domain": args.domains, "group": args.groups, "finance": args.finance}
+        started = time.perf_counter()
+        for i in range(0, args.history, HISTORY_BATCH_SIZE):
+            batch = [history_row(rng, counts, now, args.history_days) for _ in range(min(HISTORY_BATCH_SIZE, args.history - i))]
+            await db.execute(insert(models.History), batch)
+            await db.commit()
+        print(f"{'history':>10}: {args.history} rows in {time.perf_counter() - started:.1f}s")
+
+        hashed = await passwords.hash_password(args.password)
+        user = models.User(username=BENCH_USER, email="bench@example.com", hashed_password=hashed, role="Super Admin", status="active")
+        db.add(user)
+        await db.flush()
+        await search.index(db, "user", user)
+        await db.commit()
+        print(f"{'user':>10}: {BENCH_USER} / {args.password}")
+    finally:
+        await db.close()
+
+def _drop_all_sync(conn):
+    database.Base.metadata.drop_all(bind=conn)
+    if conn.dialect.name == "sqlite":
+        # the FTS table hangs off search_documents via DDL events, metadata does not know it
+        conn.execute(text("DROP TABLE IF EXISTS search_fts"))
+
+async def _drop_all():
+    if database.async_engine is not None:
+        async with database.async_engine.begin() as conn:
+            await conn.run_sync(_drop_all_sync)
+    else:
+        with database.engine.begin() as conn:
+            _drop_all_sync(conn)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.seed", description="Seed a synthetic inventory into DATABASE_URL.")
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--servers", type=int, default=100_000)
+    parser.add_argument("--domains", type=int, default=20_000)
+    parser.add_argument("--finance", type=int, default=50_000)
+    parser.add_argument("--history", type=int, default=1_000_000)
+    parser.add_argument("--history-days", type=int, default=300, help="spread of history timestamps; keep below HISTORY_RETENTION_DAYS")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default=BENCH_PASSWORD, help=f"password of the '{BENCH_USER}' Super Admin")
+    parser.add_argument("--reset", action="store_true", help="drop all tables first")
+    args = parser.parse_args(argv)
+    asyncio.run(seed(args))
+
+if __name__ == "__main__":
+    main()
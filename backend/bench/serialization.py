@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import json
+import time
+
+from sqlalchemy import select
+
+import database, loading, models, schemas, serialize
+
+# Micro-benchmark of list serialization against a seeded DATABASE_URL: the ORM path
+# (loading plan + pydantic per row) versus serialize.fetch + serialize.dumps. Both must
+# produce the same JSON; the run fails if they don't.
+
+CASES = {
+    "servers": (schemas.Server, models.Server),
+    "domains": (schemas.Domain, models.Domain),
+    "finance": (schemas.Finance, models.Finance),
+    "history": (schemas.History, models.History),
+}
+
+async def _orm(db, schema, model, rows):
+    query = select(model).options(*loading.plan(schema)).order_by(model.id).limit(rows)
+    objs = (await db.scalars(query)).unique().all()
+    return ("[" + ",".join(schemas.orm_json(schema, obj) for obj in objs) + "]").encode()
+
+async def _fast(db, schema, model, rows):
+    shape = serialize.shape(schema)
+    query = shape.select().order_by(model.id).limit(rows)
+    return serialize.dumps(await serialize.fetch(db, shape, query))
+
+async def _best(fn, repeat, *args):
+    best, body = None, None
+    for _ in range(repeat):
+        db = database.new_async_session()
+        try:
+            started = time.perf_counter()
+            body = await fn(db, *args)
+            elapsed = time.perf_counter() - started
+        finally:
+            await db.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+async def run(args):
+    await database.create_all()  # a database seeded before the latest schema change
+    print(f"encoder: {'orjson' if serialize.orjson is not None else 'json (orjson not installed)'}, rows: {args.rows}, best of {args.repeat}")
+    print(f"{'list':<10}{'rows':>8}{'orm ms':>10}{'fast ms':>10}{'speedup':>9}{'bytes':>11}")
+    failed = []
+    for name in args.lists:
+        schema, model = CASES[name]
+        orm_time, orm_body = await _best(_orm, args.repeat, schema, model, args.rows)
+        fast_time, fast_body = await _best(_fast, args.repeat, schema, model, args.rows)
+        if json.loads(orm_body) != json.loads(fast_body):
+            failed.append(name)
+        print(f"{name:<10}{len(json.loads(fast_body)):>8}{orm_time * 1000:>10.1f}{fast_time * 1000:>10.1f}{orm_time / fast_time:>8.1f}x{len(fast_body):>11}")
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.serialization", description="Compare list serialization paths for speed and output parity.")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--lists", nargs="+", choices=sorted(CASES), default=["servers", "finance"])
+    args = parser.parse_args(argv)
+
+    failed = asyncio.run(run(args))
+    if failed:
+        raise SystemExit(f"output differs from the pydantic path: {', '.join(failed)}")
+    print("output identical to the pydantic path")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import csv
+import io
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+import database, feed, history, loading, models, rollups, schemas, search
+
+# Bulk import/export of CSV or NDJSON files. Imports are validated with the same
+# *Create schemas as the single-row routes, inserted with multi-row INSERT ... RETURNING
+# in one transaction (ids are needed for the search documents, which rules out COPY)
+# and recorded as a single history entry. Exports stream straight from the database.
+# Batch updates (PATCH /api/{entity}) set the same values on every row matching an id
+# list and/or a filter: one SELECT diffs the matched rows, one UPDATE writes the ones
+# that change, and each gets its own history row - all in a single transaction.
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 50
+MAX_BATCH_ROWS = 5000
+
+class Entity:
+    def __init__(self, name, target_type, model, create_schema, base_schema, import_roles, export_roles=None, update_roles=None):
+        self.name = name
+        self.target_type = target_type
+        self.model = model
+        self.create_schema = create_schema
+        # exports carry id + the public fields (no ssh_pass); batch updates may set the same fields
+        self.base_schema = base_schema
+        self.export_fields = ["id"] + list(schemas.fields(base_schema))
+        self.roles = {"import": import_roles, "export": export_roles, "update": update_roles}
+
+# same roles as the single-row POST / GET / PUT routes
+_EDITORS = ["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]
+ENTITIES = {
+    "servers": Entity("servers", "server", models.Server, schemas.ServerCreate, schemas.ServerBase, ["Super Admin", "Admin 2L", "Service Manager"], update_roles=_EDITORS),
+    "domains": Entity("domains", "domain", models.Domain, schemas.DomainCreate, schemas.DomainBase, ["Super Admin", "Admin 2L", "Service Manager"], update_roles=_EDITORS),
+    "groups": Entity("groups", "group", models.Group, schemas.GroupCreate, schemas.GroupBase, ["Super Admin", "Admin 2L", "Service Manager"], update_roles=_EDITORS),
+    "finance": Entity("finance", "finance", models.Finance, schemas.FinanceCreate, schemas.FinanceBase, ["Super Admin", "Admin 2L", "Service Manager"], ["Super Admin", "Admin 2L"], ["Super Admin", "Admin 2L"]),
+}
+
+def get_entity(name: str, user: schemas.Principal, operation: str = "import") -> Entity:
+    entity = ENTITIES.get(name)
+    if entity is None:
+        raise HTTPException(status_code=404, detail="Unknown entity")
+    roles = entity.roles[operation]
+    if roles is not None and user.role not in roles:
+        raise HTTPException(status_code=403, detail="Operation not permitted")
+    return entity
+
+def _format(format, filename):
+    format = format or ("ndjson" if (filename or "").endswith((".ndjson", ".jsonl")) else "csv")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    return format
+
+def _records(fileobj, format):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if format == "csv":
+        for line, row in enumerate(csv.DictReader(text), start=2):
+            # empty cells mean "not set", so schema and column defaults apply
+            yield line, {k: v for k, v in row.items() if k and v != ""}
+    else:
+        for line, raw in enumerate(text, start=1):
+            if raw.strip():
+                yield line, json.loads(raw)
+
+def _column_defaults(model):
+    return {c.name: c.default.arg for c in model.__table__.columns if c.default is not None and c.default.is_scalar}
+
+def parse(entity: Entity, fileobj, format: str):
+    """Validates every record; returns insertable dicts or raises 422 listing the bad lines."""
+    defaults = _column_defaults(entity.model)
+    rows, errors = [], []
+    try:
+        for line, record in _records(fileobj, format):
+            try:
+                data = entity.create_schema(**record).dict()
+            except (TypeError, ValueError) as e:
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"line": line, "error": str(e)})
+                continue
+            rows.append({k: defaults[k] if v is None and k in defaults else v for k, v in data.items()})
+    except (UnicodeDecodeError, csv.Error, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable {format} file: {e}")
+    if errors:
+        raise HTTPException(status_code=422, detail={"message": "Validation failed, nothing was imported", "errors": errors})
+    return rows
+
+async def import_file(db, entity: Entity, file: UploadFile, format, user: str) -> dict:
+    format = _format(format, file.filename)
+    rows = await run_in_threadpool(parse, entity, file.file, format)
+    ids = []
+    try:
+        for i in range(0, len(rows), IMPORT_BATCH_SIZE):
+            batch_ids = (await db.scalars(insert(entity.model).returning(entity.model.id, sort_by_parameter_order=True), rows[i:i + IMPORT_BATCH_SIZE])).all()
+            await search.index_new(db, entity.target_type, batch_ids)
+            if entity.model is models.Finance:
+                await rollups.record_new(db, batch_ids)
+            ids.extend(batch_ids)
+        if ids:
+            summary = f"Imported {len(ids)} rows (ids {min(ids)}-{max(ids)}) from {file.filename or format}"
+            history.record(db, 0, entity.target_type, "Imported", summary, user)
+            feed.stage(db, entity.target_type, 0, "Imported", user)
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        raise HTTPException(status_code=422, detail=f"Import rejected by the database, nothing was imported: {e.orig}")
+    return {"imported": len(ids), "first_id": min(ids, default=None), "last_id": max(ids, default=None)}
+
+def _csv_line(values) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def export(entity: Entity, format: str):
+    format = _format(format, None)
+    columns = [entity.model.__table__.c[name] for name in entity.export_fields]
+    query = select(*columns).order_by(entity.model.id).execution_options(yield_per=IMPORT_BATCH_SIZE)
+
+    async def lines():
+        if format == "csv":
+            yield _csv_line(entity.export_fields)
+        db = database.new_async_session()
+        try:
+            result = await db.stream(query)
+            async for row in result:
+                if format == "csv":
+                    yield _csv_line(row)
+                else:
+                    yield json.dumps({k: _json_value(v) for k, v in zip(entity.export_fields, row)}) + "\n"
+        finally:
+            await db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(lines(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{entity.name}.{format}"'})
+
+def _validate(entity: Entity, name: str, value):
+    """`value` checked and converted like the `name` field of the entity's base schema."""
+    field = schemas.fields(entity.base_schema).get(name)
+    if field is None:
+        raise HTTPException(status_code=422, detail=f"Unknown field: {name}")
+    try:
+        if hasattr(entity.base_schema, "model_fields"):
+            from pydantic import TypeAdapter
+            return TypeAdapter(field.annotation).validate_python(value)
+        value, error = field.validate(value, {}, loc=name)
+        if error:
+            raise ValueError(error)
+        return value
+    except ValueError as e:
+        message = e.errors()[0]["msg"] if hasattr(e, "errors") else str(e)
+        raise HTTPException(status_code=422, detail=f"Invalid value for {name}: {message}")
+
+def _conditions(entity: Entity, request: schemas.BatchUpdate):
+    model = entity.model
+    if request.ids is None and not request.where:
+        raise HTTPException(status_code=422, detail="Give ids or a where filter")
+    conditions = []
+    if request.ids is not None:
+        conditions.append(model.id.in_(request.ids))
+    for name, value in (request.where or {}).items():
+        if name not in schemas.fields(entity.base_schema):
+            raise HTTPException(status_code=422, detail=f"Unknown field: {name}")
+        column = getattr(model, name)
+        if isinstance(value, list):
+            conditions.append(column.in_([_validate(entity, name, v) for v in value]))
+        elif value is None:
+            conditions.append(column.is_(None))
+        else:
+            conditions.append(column == _validate(entity, name, value))
+    return conditions
+
+async def update_rows(db, entity: Entity, request: schemas.BatchUpdate, user: str) -> dict:
+    if not request.values:
+        raise HTTPException(status_code=422, detail="Nothing to update")
+    values = {name: _validate(entity, name, value) for name, value in request.values.items()}
+    model = entity.model
+    conditions = _conditions(entity, request)
+    # old values of the columns being set, locked until commit (Postgres)
+    query = select(model.id, *[getattr(model, name) for name in values]).where(*conditions).order_by(model.id).limit(MAX_BATCH_ROWS + 1)
+    rows = (await db.execute(query.with_for_update())).all()
+    if len(rows) > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=422, detail=f"The filter matches more than {MAX_BATCH_ROWS} rows, narrow it down")
+
+    diffs = {}
+    for row in rows:
+        diff = history.diff_changes(SimpleNamespace(**row._mapping), values)
+        if diff:
+            diffs[row.id] = diff
+    changed = list(diffs)
+    if changed:
+        _, schema = search.TARGETS[entity.target_type]
+        reload = select(model).options(*loading.plan(schema)).where(model.id.in_(changed)).execution_options(populate_existing=True)
+        try:
+            before = []
+            if model is models.Finance:
+                before = [c for fin in (await db.scalars(reload)).all() for c in rollups.contributions(fin)]
+            await db.execute(update(model).where(model.id.in_(changed)).values(**values))
+            objs = (await db.scalars(reload)).all()
+            await search.index_many(db, entity.target_type, objs)
+            if model is models.Group and "title" in values:
+                for id in changed:
+                    await search.reindex_group_members(db, id)
+            if model is models.Finance:
+                await rollups.apply_change(db, before, [c for fin in objs for c in rollups.contributions(fin)])
+            if model is models.Server:
+                regrouped = [id for id, diff in diffs.items() if "group_id" in diff]
+                if regrouped:
+                    await search.reindex(db, "finance", models.Finance.server_id.in_(regrouped))
+                await rollups.move_servers(db, diffs)
+            await history.record_many(db, [
+                history.entry(id, entity.target_type, "Updated", history.format_diff(diff), user, diff) for id, diff in diffs.items()
+            ])
+            # one event: clients reload instead of patching every row
+            feed.stage(db, entity.target_type, 0, "Batch updated", user)
+            await db.commit()
+        except IntegrityError as e:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail=f"Update rejected by the database, nothing was changed: {e.orig}")
+    else:
+        await db.rollback()  # releases the row locks
+
+    results = [{"id": row.id, "result": "updated" if row.id in diffs else "unchanged", "diff": diffs.get(row.id)} for row in rows]
+    matched = {row.id for row in rows}
+    results += [{"id": id, "result": "not_matched", "diff": None} for id in dict.fromkeys(request.ids or ()) if id not in matched]
+    return {"matched": len(rows), "updated": len(changed), "results": results}
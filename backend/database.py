@@ -1,18 +1,299 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc, inspect, make_url, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+import contextvars
+import hashlib
+import hmac
+import itertools
+import logging
 import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
 
 # Беремо URL з env або використовуємо дефолт
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://cn_admin:super_secret_password@db:5432/controlnode_db")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Налаштування пулу - однакові для кожного engine (sync, async, репліки).
+# pre_ping перевіряє з'єднання перед видачею з пулу (SELECT 1), recycle закриває
+# з'єднання, старші за N секунд, - раніше, ніж їх обірве сервер чи балансувальник.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # -1 - не перевідкривати
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+
+def _pool_options(url: str, pool_class, name: str):
+    # SQLite у пам'яті лишається на своєму пулі з одним з'єднанням, решта отримує QueuePool,
+    # який віддає час очікування з'єднання в /metrics
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": metrics.timed_pool(pool_class, name),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **_pool_options(SQLALCHEMY_DATABASE_URL, QueuePool, "sync"))
+metrics.instrument_engine(engine, "sync")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+# --- Async engine ---
+# Синхронний драйвер з DATABASE_URL замінюємо на асинхронний (asyncpg / aiosqlite).
+# Якщо драйвера немає або DATABASE_ASYNC=0 - працюємо через sync Session у threadpool.
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def _async_url(url: str):
+    scheme, sep, rest = url.partition("://")
+    driver = ASYNC_DRIVERS.get(scheme)
+    return f"{driver}{sep}{rest}" if driver else None
+
+async_engine = None
+AsyncSessionLocal = None
+if os.getenv("DATABASE_ASYNC", "1") != "0" and _async_url(SQLALCHEMY_DATABASE_URL):
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        async_engine = create_async_engine(_async_url(SQLALCHEMY_DATABASE_URL), **_pool_options(SQLALCHEMY_DATABASE_URL, AsyncAdaptedQueuePool, "async"))
+        metrics.instrument_engine(async_engine.sync_engine, "async")
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    except ImportError:
+        async_engine = None
+
+class SyncSessionAdapter:
+    """Той самий awaitable API, що й AsyncSession, поверх звичайної Session.
+    Кожен виклик до БД виконується у threadpool, тож event loop не блокується."""
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalars, statement, *args, **kwargs)
+
+    async def stream(self, statement, *args, **kwargs):
+        result = await run_in_threadpool(self.sync_session.execute, statement, *args, **kwargs)
+        return self._iterate(result, statement)
+
+    async def stream_scalars(self, statement, *args, **kwargs):
+        result = await run_in_threadpool(self.sync_session.scalars, statement, *args, **kwargs)
+        return self._iterate(result, statement)
+
+    async def _iterate(self, result, statement):
+        batch = statement.get_execution_options().get("yield_per") or 500
+        while True:
+            chunk = await run_in_threadpool(result.fetchmany, batch)
+            if not chunk:
+                break
+            for row in chunk:
+                yield row
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def flush(self, objects=None):
+        await run_in_threadpool(self.sync_session.flush, objects)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def connection(self):
+        return await run_in_threadpool(self.sync_session.connection)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+def upsert_insert():
+    # insert() з on_conflict_do_update для поточного діалекту; None - оновлюємо рядок за рядком
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+def new_async_session():
+    if AsyncSessionLocal is not None:
+        return AsyncSessionLocal()
+    return SyncSessionAdapter(SessionLocal(expire_on_commit=False))
+
+# --- Репліки для читання ---
+# DATABASE_READ_URL - одна або кілька (через кому) реплік. GET-маршрути (списки, пошук,
+# історія, налаштування) читають з них по колу; репліка, до якої не вдалося під'єднатися,
+# на READ_RETRY секунд виходить з ротації, а запит читає з primary. Позначку про запис
+# несе сам клієнт (ReadYourWrites): відповідь на запит, що щось записав, отримує
+# підписаний час запису в LAST_WRITE_HEADER, і запити, що повертають його протягом
+# READ_STICKY_SECONDS, читають з primary - бачать свої зміни попри відставання
+# реплікації, на якому б воркері не опинились.
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+READ_STICKY_SECONDS = float(os.getenv("READ_STICKY_SECONDS", "5"))
+READ_RETRY = float(os.getenv("READ_RETRY", "30"))
+
+reads = metrics.Counter(
+    "db_read_sessions_total",
+    "Read sessions by target: replica, primary (no replica configured), sticky (user wrote recently) or fallback (no replica reachable).",
+    ("target",),
+)
+
+class Replica:
+    def __init__(self, url: str, name: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.down_until = 0.0
+        # той самий режим, що й у primary: AsyncSession, якщо є async-драйвер
+        if async_engine is not None and _async_url(url):
+            from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+            self.engine = create_async_engine(_async_url(url), **_pool_options(url, AsyncAdaptedQueuePool, name))
+            metrics.instrument_engine(self.engine.sync_engine, name)
+            self.session = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+        else:
+            self.engine = create_engine(url, **_pool_options(url, QueuePool, name))
+            metrics.instrument_engine(self.engine, name)
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine, expire_on_commit=False)
+            self.session = lambda: SyncSessionAdapter(factory())
+
+_read_urls = [url.strip() for url in DATABASE_READ_URL.split(",") if url.strip()]
+replicas = [Replica(url, "read" if len(_read_urls) == 1 else f"read{i}") for i, url in enumerate(_read_urls)]
+_rotation = itertools.count()
+
+LAST_WRITE_HEADER = "X-Last-Write"
+
+_request = contextvars.ContextVar("db_request", default=None)
+
+def note_write():
+    # versions._bump викликає перед commit кожної транзакції, що змінила таблиці; у sync-режимі
+    # це потік threadpool з копією контексту - тому змінюємо спільний dict, а не ContextVar
+    state = _request.get()
+    if state is not None:
+        state["wrote"] = True
+
+class ReadYourWrites:
+    """ASGI middleware: перевіряє LAST_WRITE_HEADER запиту і ставить його у відповідь,
+    якщо запит щось записав. Підпис (HMAC від `secret`) не дає клієнту назавжди
+    закріпити свої читання за primary."""
+
+    def __init__(self, app, secret: str):
+        self.app = app
+        self.secret = secret.encode()
+
+    def _sign(self, written_at: str) -> str:
+        return hmac.new(self.secret, written_at.encode(), hashlib.sha256).hexdigest()
+
+    def _recent(self, value) -> bool:
+        written_at, _, signature = (value or "").partition(".")
+        if not written_at.isdigit() or not hmac.compare_digest(signature, self._sign(written_at)):
+            return False
+        return 0 <= time.time() - int(written_at) / 1000 < READ_STICKY_SECONDS
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not replicas:
+            return await self.app(scope, receive, send)
+        state = {"sticky": self._recent(Headers(scope=scope).get(LAST_WRITE_HEADER)), "wrote": False}
+        token = _request.set(state)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and state["wrote"]:
+                written_at = str(int(time.time() * 1000))
+                MutableHeaders(scope=message).append(LAST_WRITE_HEADER, f"{written_at}.{self._sign(written_at)}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request.reset(token)
+
+async def new_read_session():
+    """Сесія лише для читання: репліка по колу, primary - якщо реплік немає, усі
+    недоступні або клієнт щойно щось записав (ReadYourWrites)."""
+    if not replicas:
+        reads.inc("primary")
+        return new_async_session()
+    state = _request.get()
+    if state is not None and state["sticky"]:
+        reads.inc("sticky")
+        return new_async_session()
+    start = next(_rotation)
+    for i in range(len(replicas)):
+        replica = replicas[(start + i) % len(replicas)]
+        if replica.down_until > time.monotonic():
+            continue
+        db = replica.session()
+        try:
+            # з'єднання беремо одразу, щоб помилка стала відомою до виконання маршруту
+            await db.connection()
+        except (exc.DBAPIError, OSError) as e:
+            await db.close()
+            replica.down_until = time.monotonic() + READ_RETRY
+            logger.warning("read replica %s unavailable, out of rotation for %.0fs: %s", replica.name, READ_RETRY, e)
+            continue
+        reads.inc("replica")
+        return db
+    reads.inc("fallback")
+    return new_async_session()
+
+def _create_all(conn):
+    Base.metadata.create_all(bind=conn)
+    # create_all не чіпає вже існуючі таблиці - докидаємо нові колонки та індекси
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=conn, checkfirst=True)
+
+async def create_all():
+    if async_engine is not None:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(_create_all)
+    else:
+        with engine.begin() as conn:
+            await run_in_threadpool(_create_all, conn)
+
+async def get_async_db():
+    db = new_async_session()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import select, update
+
+import cache, database, feed, history, jobs, metrics, models
+
+logger = logging.getLogger(__name__)
+
+# Fills Domain.ns / a_record / aaaa_record. Every DNS_REFRESH_INTERVAL seconds (and on
+# POST /api/domains/refresh) all domains are resolved concurrently, at most
+# DNS_CONCURRENCY at a time; answers are cached for their own TTL, so a refresh inside
+# that window costs no queries. Only rows whose records changed are written, in one
+# executemany UPDATE with a history row each. A lookup that fails (timeout, SERVFAIL)
+# leaves the stored value alone; NXDOMAIN / no answer clears it. One refresh runs at a
+# time across all workers (jobs.Job).
+DNS_REFRESH_INTERVAL = float(os.environ.get("DNS_REFRESH_INTERVAL", "3600"))  # 0 disables the background job
+DNS_CONCURRENCY = int(os.environ.get("DNS_CONCURRENCY", "100"))
+DNS_TIMEOUT = float(os.environ.get("DNS_TIMEOUT", "3.0"))
+DNS_NAMESERVERS = os.environ.get("DNS_NAMESERVERS", "")  # "ip[:port],..."; empty uses /etc/resolv.conf
+DNS_CACHE_SIZE = 100_000
+NEGATIVE_TTL = 300  # NXDOMAIN / empty answers
+MAX_TTL = 86400
+REFRESH_USER = "DNS refresh"
+
+# column -> record type
+RECORDS = {"ns": "NS", "a_record": "A", "aaaa_record": "AAAA"}
+
+_cache = cache.TTLCache(maxsize=DNS_CACHE_SIZE, ttl=NEGATIVE_TTL)
+_MISSING = object()
+
+lookups = metrics.Counter("dns_lookups_total", "DNS lookups by result: cached, resolved, empty or failed.", ("result",))
+refreshes = metrics.Counter("dns_refreshes_total", "Domain DNS refresh runs by trigger.", ("trigger",))
+rows_updated = metrics.Counter("dns_rows_updated_total", "Domains whose stored records changed.")
+_last = {"seconds": 0.0}
+metrics.Gauge("dns_refresh_last_seconds", "Duration of the last DNS refresh.", lambda: _last["seconds"])
+
+class LookupFailed(Exception):
+    pass
+
+def _resolver():
+    import dns.asyncresolver
+    resolver = dns.asyncresolver.Resolver(configure=not DNS_NAMESERVERS)
+    if DNS_NAMESERVERS:
+        servers = [s.strip() for s in DNS_NAMESERVERS.split(",") if s.strip()]
+        # one port for all of them - enough for a local stub on a non-standard port
+        hosts = [s.rsplit(":", 1) if s.count(":") == 1 else [s] for s in servers]
+        resolver.nameservers = [h[0] for h in hosts]
+        resolver.port = int(hosts[0][1]) if len(hosts[0]) == 2 else 53
+    resolver.lifetime = DNS_TIMEOUT
+    resolver.cache = None  # _cache keeps answers per (name, type) across runs
+    return resolver
+
+def _text(rdtype: str, rrset) -> str:
+    # sorted, so round-robin ordering alone never counts as a change
+    if rdtype == "NS":
+        values = [rr.target.to_text(omit_final_dot=True) for rr in rrset]
+    else:
+        values = [rr.address for rr in rrset]
+    return ", ".join(sorted(values))
+
+async def _lookup(resolver, name: str, rdtype: str):
+    import dns.exception, dns.resolver
+    hit = _cache.get((name, rdtype), _MISSING)
+    if hit is not _MISSING:
+        lookups.inc("cached")
+        return hit
+    try:
+        answer = await resolver.resolve(name, rdtype, search=False)
+        value, ttl = _text(rdtype, answer.rrset), answer.rrset.ttl
+        lookups.inc("resolved")
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        value, ttl = None, NEGATIVE_TTL
+        lookups.inc("empty")
+    except dns.exception.DNSException as e:
+        lookups.inc("failed")
+        raise LookupFailed(f"{name} {rdtype}: {e}")
+    _cache.set((name, rdtype), value, min(ttl, MAX_TTL))
+    return value
+
+async def resolve(resolver, semaphore, name: str) -> dict:
+    """{column: value} for the record types that resolved; failed ones are left out."""
+    name = (name or "").strip().rstrip(".").lower()
+    if not name:
+        return {}
+    async with semaphore:
+        results = await asyncio.gather(*[_lookup(resolver, name, t) for t in RECORDS.values()], return_exceptions=True)
+    records = {}
+    for column, result in zip(RECORDS, results):
+        if isinstance(result, LookupFailed):
+            logger.debug("%s", result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            records[column] = result
+    return records
+
+async def refresh(ids=None, user: str = REFRESH_USER, trigger: str = "manual") -> dict:
+    """Resolves the given domains (all when `ids` is None) and stores changed records;
+    jobs.AlreadyRunning if a refresh is running in any worker."""
+    async with refresher.exclusive():
+        started = time.perf_counter()
+        refreshes.inc(trigger)
+        query = select(models.Domain.id, models.Domain.name, *[getattr(models.Domain, c) for c in RECORDS]).order_by(models.Domain.id)
+        if ids is not None:
+            query = query.where(models.Domain.id.in_(ids))
+        db = database.new_async_session()
+        try:
+            rows = (await db.execute(query)).all()
+        finally:
+            # no pooled connection is held while waiting on DNS
+            await db.close()
+        resolver = _resolver()
+        semaphore = asyncio.Semaphore(DNS_CONCURRENCY)
+        results = await asyncio.gather(*[resolve(resolver, semaphore, row.name) for row in rows])
+
+        changes, failed = [], 0
+        for row, records in zip(rows, results):
+            if len(records) < len(RECORDS):
+                failed += 1
+            diff = {c: [getattr(row, c), v] for c, v in records.items() if getattr(row, c) != v}
+            if diff:
+                changes.append((row, diff))
+        if changes:
+            db = database.new_async_session()
+            try:
+                params = [{"id": row.id, **{c: getattr(row, c) for c in RECORDS}, **{c: v[1] for c, v in diff.items()}} for row, diff in changes]
+                await db.execute(update(models.Domain), params)
+                await history.record_many(db, [history.entry(row.id, "domain", "Updated", history.format_diff(diff), user, diff) for row, diff in changes])
+                # one event: clients reload the list instead of patching thousands of rows
+                feed.stage(db, "domain", 0, "Refreshed", user)
+                await db.commit()
+            finally:
+                await db.close()
+            rows_updated.inc(amount=len(changes))
+        _last["seconds"] = time.perf_counter() - started
+        return {"domains": len(rows), "changed": len(changes), "failed": failed, "seconds": round(_last["seconds"], 3)}
+
+async def _scheduled():
+    result = await refresh(trigger="scheduled")
+    logger.info("DNS refresh: %(domains)d domains, %(changed)d changed, %(failed)d failed in %(seconds).1fs", result)
+
+refresher = jobs.Job("dns_refresh", DNS_REFRESH_INTERVAL, _scheduled)
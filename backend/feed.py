@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import event, make_url
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+import database, metrics, schemas, serialize
+
+logger = logging.getLogger(__name__)
+
+# Live change feed (Server-Sent Events on /api/changes). Every add_log also stages an event
+# with the changed row, serialized the way the list endpoints return it; once the
+# transaction commits the event goes to the backend, which fans it out to subscribers
+# allowed to read that entity type. "local" fans out inside this process only; with
+# several workers use "postgres", which carries events between workers via LISTEN/NOTIFY.
+CHANGE_FEED_BACKEND = os.environ.get("CHANGE_FEED_BACKEND", "local")
+CHANGE_FEED_QUEUE = int(os.environ.get("CHANGE_FEED_QUEUE", "1000"))  # a subscriber this far behind is cut off
+HEARTBEAT_SECONDS = 15.0
+CHANNEL = "cn_changes"
+NOTIFY_LIMIT = 7900  # NOTIFY payloads must stay below 8000 bytes; bigger events go out without the row
+
+# entity type -> (model, response schema)
+TARGETS = serialize.ENTITIES
+# same restrictions as the GET routes; types not listed are visible to every user
+READ_ROLES = {
+    "finance": ["Super Admin", "Admin 2L"],
+    "user": ["Super Admin", "Admin 2L"],
+}
+
+_PENDING = "pending_changes"
+
+def stage(db, target_type: str, target_id: int, action: str, user: str):
+    """Queues an event for broadcast after the caller's transaction commits. The row is taken
+    from the session as the route loaded it; without it clients refetch the row themselves."""
+    session = db.sync_session
+    data = None
+    target = TARGETS.get(target_type)
+    if target is not None and target_id:
+        obj = session.identity_map.get(identity_key(target[0], target_id))
+        if obj is not None:
+            try:
+                data = json.loads(schemas.orm_json(target[1], obj))
+            except (InvalidRequestError, ValueError):
+                # a relationship outside the loading plan - send the event without the row
+                data = None
+    session.info.setdefault(_PENDING, []).append(
+        {"type": target_type, "id": target_id or None, "action": action, "user": user, "data": data}
+    )
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    events = session.info.pop(_PENDING, None)
+    if events:
+        hub.publish(events)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING, None)
+
+class Subscriber:
+    def __init__(self, role: str, types):
+        self.role = role
+        self.types = set(types or ())
+        self.queue = asyncio.Queue(CHANGE_FEED_QUEUE)
+
+    def accepts(self, change: dict) -> bool:
+        if self.types and change["type"] not in self.types:
+            return False
+        roles = READ_ROLES.get(change["type"])
+        return roles is None or self.role in roles
+
+class LocalBackend:
+    def __init__(self, hub):
+        self.hub = hub
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def send(self, change: dict):
+        self.hub.dispatch(change)
+
+class PostgresBackend:
+    """Every worker NOTIFYs its own commits and dispatches whatever it hears on CHANNEL,
+    its own events included, so all workers see the same stream."""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+        self._reconnect = None
+        self._stopping = False
+
+    async def start(self):
+        await self._connect()
+
+    async def _connect(self):
+        import asyncpg
+        dsn = make_url(database.SQLALCHEMY_DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._conn = await asyncpg.connect(dsn)
+        await self._conn.add_listener(CHANNEL, self._on_notify)
+        self._conn.add_termination_listener(self._on_terminated)
+
+    def _on_terminated(self, conn):
+        if not self._stopping and self._reconnect is None:
+            logger.warning("change feed lost its LISTEN connection, reconnecting")
+            self._reconnect = asyncio.get_running_loop().create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        delay = 1.0
+        while not self._stopping:
+            try:
+                await self._connect()
+                break
+            except Exception:
+                logger.exception("change feed reconnect failed, retrying in %.0fs", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        self._reconnect = None
+
+    async def stop(self):
+        self._stopping = True
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        if self._conn is not None:
+            await self._conn.close()
+
+    def send(self, change: dict):
+        task = asyncio.get_running_loop().create_task(self._notify(change))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _notify(self, change: dict):
+        payload = json.dumps(change)
+        if len(payload.encode()) > NOTIFY_LIMIT:
+            payload = json.dumps({**change, "data": None})
+        try:
+            async with self._lock:
+                await self._conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+        except Exception:
+            dropped.inc("notify_failed")
+            logger.exception("change feed NOTIFY failed, event lost")
+
+    def _on_notify(self, conn, pid, channel, payload):
+        self.hub.dispatch(json.loads(payload))
+
+BACKENDS = {"local": LocalBackend, "postgres": PostgresBackend}
+
+class Hub:
+    def __init__(self):
+        self.subscribers = set()
+        self.backend = None
+        self._loop = None
+
+    async def start(self):
+        if CHANGE_FEED_BACKEND not in BACKENDS:
+            raise ValueError(f"CHANGE_FEED_BACKEND must be one of {', '.join(BACKENDS)}")
+        self._loop = asyncio.get_running_loop()
+        self.backend = BACKENDS[CHANGE_FEED_BACKEND](self)
+        await self.backend.start()
+
+    async def stop(self):
+        for subscriber in list(self.subscribers):
+            self._close(subscriber)
+        if self.backend is not None:
+            await self.backend.stop()
+        self._loop = None
+
+    def publish(self, events):
+        # called from commit, which may run on a threadpool thread in sync mode
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._send, events)
+
+    def _send(self, events):
+        if self.backend is None:
+            return
+        for change in events:
+            published.inc(change["type"])
+            self.backend.send(change)
+
+    def dispatch(self, change: dict):
+        for subscriber in list(self.subscribers):
+            if not subscriber.accepts(change):
+                continue
+            try:
+                subscriber.queue.put_nowait(change)
+            except asyncio.QueueFull:
+                # cut off; the client reconnects and reloads instead of getting a gap it can't see
+                dropped.inc("slow_subscriber")
+                self._close(subscriber)
+
+    def subscribe(self, role: str, types=None) -> Subscriber:
+        subscriber = Subscriber(role, types)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def _close(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+hub = Hub()
+
+published = metrics.Counter("change_feed_events_total", "Committed changes published to the feed.", ("type",))
+dropped = metrics.Counter("change_feed_dropped_total", "Feed deliveries given up: slow_subscriber or notify_failed.", ("reason",))
+metrics.Gauge("change_feed_subscribers", "Open change feed streams.", lambda: len(hub.subscribers))
+
+def stream(user: schemas.Principal, types, expires_at: float, current) -> StreamingResponse:
+    """text/event-stream of the changes `user` may see; ends when the token expires or when
+    `current()` (an async lookup of the user's principal) no longer returns an active user
+    with the same role."""
+    subscriber = hub.subscribe(user.role, types)
+
+    async def allowed() -> bool:
+        principal = await current()
+        return principal is not None and principal.status == "active" and principal.role == user.role
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            recheck = time.monotonic() + HEARTBEAT_SECONDS
+            while True:
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    break
+                if time.monotonic() >= recheck:
+                    if not await allowed():
+                        break
+                    recheck = time.monotonic() + HEARTBEAT_SECONDS
+                try:
+                    change = await asyncio.wait_for(subscriber.queue.get(), min(HEARTBEAT_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if change is None:
+                    break
+                yield f"event: change\ndata: {json.dumps(change)}\n\n"
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+
+import database, jobs, metrics, models
+
+logger = logging.getLogger(__name__)
+
+# History rows are written in the same transaction as the change they describe.
+# With HISTORY_BATCH=1 they are instead handed to an in-process buffer once that
+# transaction commits and inserted in multi-row batches every HISTORY_FLUSH_INTERVAL
+# seconds or HISTORY_BATCH_SIZE rows - fewer round trips under write load, at the
+# price of losing the still-buffered rows if the process dies.
+HISTORY_BATCH = os.environ.get("HISTORY_BATCH", "0") == "1"
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "500"))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "1.0"))
+
+_PENDING = "pending_history"
+
+HISTORY_RETENTION_DAYS = int(os.environ.get("HISTORY_RETENTION_DAYS", "365"))  # 0 keeps everything hot
+HISTORY_ARCHIVE_INTERVAL = float(os.environ.get("HISTORY_ARCHIVE_INTERVAL", "3600"))
+HISTORY_ARCHIVE_BATCH = 5000
+
+def _json_value(value):
+    return value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+
+# credentials: history shows that they changed, never the values
+SECRET_FIELDS = {"hashed_password", "ssh_pass", "cont_pass"}
+REDACTED = "***"
+
+def diff_changes(obj, update_data: dict) -> dict:
+    """Applies `update_data` to `obj` and returns what changed as {field: [old, new]}."""
+    diff = {}
+    for key, value in update_data.items():
+        if hasattr(obj, key) and getattr(obj, key) != value:
+            if key in SECRET_FIELDS:
+                diff[key] = [REDACTED, REDACTED]
+            else:
+                diff[key] = [_json_value(getattr(obj, key)), _json_value(value)]
+            setattr(obj, key, value)
+    return diff
+
+def format_diff(diff: dict) -> str:
+    return " | ".join(f"{key}: {old} -> {new}" for key, (old, new) in diff.items())
+
+def entry(t_id: int, t_type: str, action: str, change: str, user: str, diff: dict = None) -> dict:
+    return dict(target_id=t_id, target_type=t_type, action=action, changes=change, diff=diff, user=user, timestamp=datetime.utcnow())
+
+def record(db, t_id: int, t_type: str, action: str, change: str, user: str, diff: dict = None):
+    row = entry(t_id, t_type, action, change, user, diff)
+    if writer.running:
+        db.sync_session.info.setdefault(_PENDING, []).append(row)
+    else:
+        db.add(models.History(**row))
+
+async def record_many(db, rows):
+    """record() for many entry() rows: one executemany INSERT in the caller's transaction."""
+    if writer.running:
+        db.sync_session.info.setdefault(_PENDING, []).extend(rows)
+    elif rows:
+        await db.execute(insert(models.History), rows)
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    rows = session.info.pop(_PENDING, None)
+    if rows:
+        writer.submit(rows)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING, None)
+
+class HistoryWriter:
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.running = False
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wake = None
+        self._task = None
+        self.flushes = 0
+        self.flush_errors = 0
+        self.rows_written = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    @property
+    def buffer_depth(self) -> int:
+        return len(self._buffer)
+
+    def submit(self, rows):
+        # called from commit, which may run on a threadpool thread in sync mode
+        with self._lock:
+            self._buffer.extend(rows)
+            full = len(self._buffer) >= self.batch_size
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        self.running = True
+
+    async def stop(self):
+        self.running = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        started = time.perf_counter()
+        db = database.new_async_session()
+        try:
+            for i in range(0, len(rows), self.batch_size):
+                await db.execute(insert(models.History), rows[i:i + self.batch_size])
+            await db.commit()
+        except Exception:
+            self.flush_errors += 1
+            logger.exception("history flush of %d rows failed, keeping them buffered", len(rows))
+            with self._lock:
+                self._buffer[:0] = rows
+            return
+        finally:
+            await db.close()
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.rows_written += len(rows)
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+writer = HistoryWriter(HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL)
+
+metrics.Gauge("history_buffer_depth", "History rows waiting for the batch writer.", lambda: writer.buffer_depth)
+metrics.Gauge("history_rows_written_total", "History rows inserted by the batch writer.", lambda: writer.rows_written, kind="counter")
+metrics.Gauge("history_flushes_total", "Batch writer flushes.", lambda: writer.flushes, kind="counter")
+metrics.Gauge("history_flush_errors_total", "Batch writer flushes that failed and were retried.", lambda: writer.flush_errors, kind="counter")
+metrics.Gauge("history_last_flush_seconds", "Duration of the last batch writer flush.", lambda: writer.last_flush_seconds)
+
+async def archive_old_rows(cutoff: datetime = None) -> int:
+    """Moves history rows older than `cutoff` into history_archive in batches; returns the
+    count. One run at a time across workers - two would copy the same rows twice."""
+    cutoff = cutoff or datetime.utcnow() - timedelta(days=HISTORY_RETENTION_DAYS)
+    columns = [c.name for c in models.History.__table__.columns]
+    moved = 0
+    async with archiver.exclusive():
+        db = database.new_async_session()
+        try:
+            while True:
+                ids = (await db.scalars(
+                    select(models.History.id).where(models.History.timestamp < cutoff).order_by(models.History.id).limit(HISTORY_ARCHIVE_BATCH)
+                )).all()
+                if not ids:
+                    break
+                rows = select(*[models.History.__table__.c[name] for name in columns]).where(models.History.id.in_(ids))
+                await db.execute(insert(models.HistoryArchive).from_select(columns, rows))
+                await db.execute(delete(models.History).where(models.History.id.in_(ids)))
+                await db.commit()
+                moved += len(ids)
+        finally:
+            await db.close()
+    return moved
+
+async def _scheduled():
+    moved = await archive_old_rows()
+    if moved:
+        logger.info("archived %d history rows", moved)
+
+# runs at startup, then every HISTORY_ARCHIVE_INTERVAL seconds
+archiver = jobs.Job("history_archive", HISTORY_ARCHIVE_INTERVAL if HISTORY_RETENTION_DAYS > 0 else 0, _scheduled, delay_first=False)
@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+from fastapi import Request, Response
+
+import cache, metrics, serialize, singleflight, versions
+
+# Conditional GET + in-process response cache for list endpoints. The ETag is derived
+# from (path, query, role) and the versions of the tables the response reads, so it
+# is the same in every worker and changes with any committed write to those tables.
+# A matching If-None-Match costs one version lookup and returns 304; otherwise a
+# cached body for the same ETag is served without touching the entity tables or
+# re-serializing. Concurrent misses for the same ETag run the query once and share the
+# body (singleflight), so a burst of identical requests costs one build.
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "128"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+
+response_cache = cache.TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+lookups = metrics.Counter("http_cache_lookups_total", "List responses by outcome: not_modified, hit or miss.", ("result",))
+metrics.Gauge("http_cache_entries", "Serialized list responses held in memory.", lambda: len(response_cache))
+flights = singleflight.Group("list")
+
+# comma separated names read as a set by serialize.projection
+_NAME_LISTS = ("fields", "include")
+
+def _params(request: Request):
+    # query strings the route parses identically map to one key: format=json is the
+    # default and field lists are read as sets. Everything else is kept as sent -
+    # an empty fields= selects only id, q=" " runs a search.
+    params = []
+    for name, value in request.query_params.multi_items():
+        if name == "format" and value == "json":
+            continue
+        if name in _NAME_LISTS:
+            value = ",".join(sorted({v.strip() for v in value.split(",") if v.strip()}))
+        params.append((name, value))
+    return tuple(sorted(params))
+
+def _key(request: Request, role: str):
+    return request.url.path, _params(request), role
+
+def _etag(key, table_versions: dict) -> str:
+    raw = repr((key, sorted(table_versions.items()))).encode()
+    return '"' + hashlib.sha1(raw).hexdigest() + '"'
+
+def _matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    return header is not None and (header.strip() == "*" or etag in [t.strip() for t in header.split(",")])
+
+async def cached_list(request: Request, response: Response, db, role: str, tables, build, vary=()):
+    """Runs `build()` (which returns serialize rows, or a streaming Response) only when
+    neither the client nor the response cache holds the current version of this list.
+    `vary` holds anything else the response depends on, e.g. a default taken from the clock."""
+    key = _key(request, role) + tuple(vary)
+    etag = _etag(key, await versions.current(db, tables))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _matches(request, etag):
+        lookups.inc("not_modified")
+        return Response(status_code=304, headers=headers)
+    hit = response_cache.get(key)
+    if hit is not None and hit[0] == etag:
+        lookups.inc("hit")
+        return Response(content=hit[1], media_type="application/json", headers={**hit[2], **headers})
+    lookups.inc("miss")
+    if request.query_params.get("format") == "ndjson":
+        # a stream can be read only once, nothing to share
+        return await build()
+
+    async def render():
+        rows = await build()
+        body = serialize.dumps(rows)
+        # headers the builder set, e.g. X-Next-Cursor
+        extra = {k: v for k, v in response.headers.items() if k.lower() not in ("content-length", "content-type")}
+        response_cache.set(key, (etag, body, extra))
+        return body, extra
+
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    body, extra = await flights.do((key, etag), render, route)
+    return Response(content=body, media_type="application/json", headers={**extra, **headers})
@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+
+from sqlalchemy import BigInteger, func, literal, select
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Periodic background jobs (DNS refresh, SSH probe sweep, history archiving). Every
+# worker schedules them, so a run takes exclusive(): an asyncio lock inside the process
+# and, on Postgres, a transaction-level advisory lock held on a connection of its own
+# until the run ends - a worker that finds it taken skips its turn instead of repeating
+# the work. Other databases only get the in-process lock; run a single worker there
+# (several workers need Postgres for the change feed anyway).
+
+class AlreadyRunning(Exception):
+    pass
+
+class Job:
+    def __init__(self, name: str, interval: float, scheduled, delay_first: bool = True):
+        """`scheduled` is the coroutine function run every `interval` seconds (0 disables
+        the schedule); with `delay_first` False the first run starts right away."""
+        self.name = name
+        self.interval = interval
+        self.scheduled = scheduled
+        self.delay_first = delay_first
+        self._lock = asyncio.Lock()
+        self._task = None
+        # advisory lock keys are bigints; derived from the name so every worker agrees
+        self._key = int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], "big", signed=True)
+
+    @asynccontextmanager
+    async def exclusive(self):
+        """Held for one run; raises AlreadyRunning if any worker is running the job."""
+        if self._lock.locked():
+            raise AlreadyRunning()
+        async with self._lock:
+            if database.engine.dialect.name != "postgresql":
+                yield
+                return
+            db = database.new_async_session()
+            try:
+                if not await db.scalar(select(func.pg_try_advisory_xact_lock(literal(self._key, BigInteger)))):
+                    raise AlreadyRunning()
+                yield
+            finally:
+                # ends the transaction, which releases the lock
+                await db.close()
+
+    async def _loop(self):
+        delay = self.interval if self.delay_first else 0
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.interval
+            try:
+                await self.scheduled()
+            except AlreadyRunning:
+                logger.debug("%s already running in another worker, skipped", self.name)
+            except Exception:
+                logger.exception("%s failed", self.name)
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
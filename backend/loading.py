@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+
+import database, models, schemas
+
+# Loading plan per response model: the relationships each schema serializes, joined
+# into the same SELECT. They are all to-one, so a list stays one statement however
+# many rows it returns. Relationships are lazy="raise_on_sql" in models.py - a nested
+# field without a plan fails loudly instead of turning into N+1.
+_GROUP = (joinedload(models.Group.project),)
+_SERVER = (
+    joinedload(models.Server.group).options(*_GROUP),
+    joinedload(models.Server.project),
+    joinedload(models.Server.probe),
+)
+
+PLANS = {
+    schemas.Server: _SERVER,
+    schemas.Domain: (joinedload(models.Domain.group).options(*_GROUP),),
+    schemas.Group: _GROUP,
+    schemas.Finance: (joinedload(models.Finance.server).options(*_SERVER),),
+}
+
+def plan(schema):
+    return PLANS.get(schema, ())
+
+def _engines():
+    engines = [database.engine]
+    if database.async_engine is not None:
+        engines.append(database.async_engine.sync_engine)
+    for replica in database.replicas:
+        engines.append(getattr(replica.engine, "sync_engine", replica.engine))
+    return engines
+
+@contextmanager
+def count_queries():
+    """Collects every SQL statement executed while the block runs; bench/queries.py uses
+    it to check statement counts don't grow with the data.
+
+        with loading.count_queries() as statements:
+            client.get("/api/finance")
+        assert len(statements) == ...
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = _engines()
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
@@ -1,28 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy import select
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import List, Optional
 
-import models, schemas, database
+import models, schemas, database, pagination, loading, search, cache, passwords, history, bulk, versions, http_cache, rollups, metrics, feed, serialize, dns_refresh, probe, overview, jobs
 import os
+import time
 
 # --- Security & Auth ---
 SECRET_KEY = os.environ.get("SECRET_KEY", "a_very_secret_key_for_jwt")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/token")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Decoded tokens and resolved principals are kept in-process for AUTH_CACHE_TTL seconds;
+# update_user / update_my_settings drop the entry so role and status changes apply at once.
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", "30"))
+token_cache = cache.TTLCache(maxsize=4096, ttl=AUTH_CACHE_TTL)
+principal_cache = cache.TTLCache(maxsize=1024, ttl=AUTH_CACHE_TTL)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/token")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -33,30 +32,59 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def invalidate_principal(*usernames: str):
+    for username in usernames:
+        principal_cache.pop(username)
+
+async def load_principal(db, username: str) -> Optional[schemas.Principal]:
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = await db.scalar(select(models.User).where(models.User.username == username))
+        if user is None:
+            return None
+        principal = schemas.Principal(id=user.id, username=user.username, role=user.role, status=user.status)
+        principal_cache.set(username, principal)
+    return principal
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(database.get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            # scoped tokens (change feed tickets) are not access tokens
+            if username is None or payload.get("scope"):
+                raise credentials_exception
+            token_data = schemas.TokenData(username=username)
+        except JWTError:
             raise credentials_exception
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
+        username = token_data.username
+        token_cache.set(token, username, ttl=min(AUTH_CACHE_TTL, payload["exp"] - time.time()))
+    principal = await load_principal(db, username)
+    if principal is None:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
-    return user
+    if principal.status != "active":
+        raise HTTPException(status_code=403, detail=f"User account is {principal.status}")
+    return principal
+
+async def get_read_db(current_user: schemas.Principal = Depends(get_current_user)):
+    # GET routes read from a replica when DATABASE_READ_URL is set (database.new_read_session)
+    db = await database.new_read_session()
+    try:
+        yield db
+    finally:
+        await db.close()
 
 class RoleChecker:
     def __init__(self, allowed_roles: List[str]):
         self.allowed_roles = allowed_roles
 
-    def __call__(self, user: models.User = Depends(get_current_user)):
+    def __call__(self, user: schemas.Principal = Depends(get_current_user)):
         if user.role not in self.allowed_roles:
             raise HTTPException(status_code=403, detail="Operation not permitted")
         return user
@@ -64,22 +92,30 @@ class RoleChecker:
 # --- App Initialization ---
 app = FastAPI()
 
+# innermost: it marks responses to requests that committed a write
+app.add_middleware(database.ReadYourWrites, secret=SECRET_KEY)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag", database.LAST_WRITE_HEADER],
 )
+# outermost, so the recorded latency includes CORS handling and the full streamed body
+app.add_middleware(metrics.MetricsMiddleware)
 
 @app.on_event("startup")
-def startup():
-    database.Base.metadata.create_all(bind=database.engine)
-    db = database.SessionLocal()
-    if not db.query(models.User).filter(models.User.username == "SuperAdmin").first():
+async def startup():
+    await database.create_all()
+    db = database.new_async_session()
+    await versions.seed(db)
+    await search.backfill(db)
+    await rollups.backfill(db)
+    if not await db.scalar(select(models.User).where(models.User.username == "SuperAdmin")):
         superadmin_password = os.environ.get("SUPERADMIN_PASSWORD", "superadmin_password")
         superadmin_email = os.environ.get("SUPERADMIN_EMAIL", "admin@controlnode.com")
-        hashed_password = get_password_hash(superadmin_password)
+        hashed_password = await passwords.hash_password(superadmin_password)
         super_admin = models.User(
             username="SuperAdmin",
             email=superadmin_email,
@@ -88,21 +124,58 @@ def startup():
             status="active"
         )
         db.add(super_admin)
-        db.commit()
-    db.close()
+        await db.flush()
+        # search.backfill above ran before this row existed
+        await search.index(db, "user", super_admin)
+        await db.commit()
+    await db.close()
+    if history.HISTORY_BATCH:
+        await history.writer.start()
+    history.archiver.start()
+    dns_refresh.refresher.start()
+    probe.prober.start()
+    await feed.hub.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await feed.hub.stop()
+    await dns_refresh.refresher.stop()
+    await probe.prober.stop()
+    await history.archiver.stop()
+    await history.writer.stop()
 
 # --- Utility ---
-def add_log(db: Session, t_id: int, t_type: str, action: str, change: str, user: str):
-    log = models.History(target_id=t_id, target_type=t_type, action=action, changes=change, user=user)
-    db.add(log)
-    db.commit()
+def add_log(db, t_id: int, t_type: str, action: str, change: str, user: str, diff: dict = None):
+    # staged in the caller's transaction (or handed to the batch writer on commit);
+    # the change feed broadcasts the same event once the transaction commits
+    history.record(db, t_id, t_type, action, change, user, diff)
+    feed.stage(db, t_type, t_id, action, user)
+
+async def get_one(db, model, id: int, options=(), lock: bool = False):
+    stmt = select(model).where(model.id == id).options(*options).execution_options(populate_existing=True)
+    if lock:
+        # FOR UPDATE OF the entity's own table: the joined relationships are outer joins
+        stmt = stmt.with_for_update(of=model)
+    return await db.scalar(stmt)
+
+# Keyset pagination: ?limit=&cursor= pages by id (X-Next-Cursor header holds the next cursor),
+# ?format=ndjson streams the rows instead of building one JSON array.
+# Sparse fieldsets: ?fields=id,ip,status returns only those columns, ?include=group adds a
+# relationship back; both narrow the SELECT itself (see serialize.projection).
+Limit = Query(None, ge=1, le=pagination.MAX_LIMIT)
 
 # --- Auth Endpoint ---
 @app.post("/api/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(database.get_async_db)):
+    user = await db.scalar(select(models.User).where(models.User.username == form_data.username))
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
+    valid, new_hash = await passwords.verify_and_update(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     if user.status != "active":
          raise HTTPException(status_code=403, detail=f"User account is {user.status}")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -112,189 +185,265 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 # --- API Endpoints (Protected) ---
 
 @app.get("/api/servers", response_model=List[schemas.Server])
-async def get_servers(q: Optional[str] = None, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    query = db.query(models.Server)
-    if q:
-        query = query.filter(
-            models.Server.id.ilike(f"%{q}%") |
-            models.Server.ip.ilike(f"%{q}%") |
-            models.Server.project.has(models.Project.title.ilike(f"%{q}%")) |
-            models.Server.group.has(models.Group.title.ilike(f"%{q}%"))
-        )
-    return query.all()
+async def get_servers(request: Request, response: Response, q: Optional[str] = None, limit: Optional[int] = Limit, cursor: Optional[str] = None, format: Optional[str] = None, fields: Optional[str] = None, include: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(get_current_user)):
+    shape = serialize.shape(schemas.Server, only=serialize.projection(schemas.Server, fields, include))
+    async def build():
+        query = shape.select()
+        if q:
+            return await search.ranked_response(db, query, "server", q, limit, shape, format)
+        return await pagination.list_response(db, response, query, [models.Server.id], shape, limit, cursor, format)
+    return await http_cache.cached_list(request, response, db, current_user.role, ("servers", "groups", "projects", "server_probes"), build)
 
 @app.post("/api/servers", response_model=schemas.Server)
-async def add_server(server: schemas.ServerCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
+async def add_server(server: schemas.ServerCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
     srv = models.Server(**server.dict())
     db.add(srv)
-    db.commit()
-    db.refresh(srv)
+    await db.flush()
+    srv = await get_one(db, models.Server, srv.id, loading.plan(schemas.Server))
+    await search.index(db, "server", srv)
     add_log(db, srv.id, "server", "Created", f"IP: {srv.ip}", current_user.username)
+    await db.commit()
     return srv
 
+# SSH port reachability (probe.py); each server's last result is its `probe` field
+@app.get("/api/servers/reachability", response_model=schemas.ProbeSummary)
+async def get_reachability(db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(get_current_user)):
+    return await probe.summary(db)
+
+@app.post("/api/servers/probe", response_model=schemas.ProbeRunResult)
+async def probe_servers(request: schemas.ProbeRequest = None, current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]))):
+    try:
+        return await probe.sweep(request.ids if request else None)
+    except jobs.AlreadyRunning:
+        raise HTTPException(status_code=409, detail="A probe sweep is already running")
+
 @app.get("/api/servers/{id}", response_model=schemas.Server)
-async def get_server(id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    return db.query(models.Server).filter(models.Server.id == id).first()
+async def get_server(id: int, fields: Optional[str] = None, include: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(get_current_user)):
+    only = serialize.projection(schemas.Server, fields, include)
+    if only is None:
+        srv = await get_one(db, models.Server, id, loading.plan(schemas.Server))
+        if not srv: raise HTTPException(status_code=404, detail="Server not found")
+        return srv
+    shape = serialize.shape(schemas.Server, only=only)
+    rows = await serialize.fetch(db, shape, shape.select().where(models.Server.id == id))
+    if not rows: raise HTTPException(status_code=404, detail="Server not found")
+    return Response(content=serialize.dumps(rows[0]), media_type="application/json")
 
 @app.put("/api/servers/{id}", response_model=schemas.Server)
-async def update_server(id: int, server_data: schemas.ServerCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]))):
-    srv = db.query(models.Server).filter(models.Server.id == id).first()
+async def update_server(id: int, server_data: schemas.ServerCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]))):
+    # locked until commit, so concurrent updates compute their rollup moves from committed values
+    srv = await get_one(db, models.Server, id, loading.plan(schemas.Server), lock=True)
     if not srv: raise HTTPException(status_code=404, detail="Server not found")
     
     update_data = server_data.dict(exclude_unset=True)
-    diff = []
-    for key, value in update_data.items():
-        if hasattr(srv, key) and getattr(srv, key) != value:
-            diff.append(f"{key}: {getattr(srv, key)} -> {value}")
-            setattr(srv, key, value)
+    diff = history.diff_changes(srv, update_data)
     
     if diff:
-        db.commit()
-        add_log(db, id, "server", "Updated", " | ".join(diff), current_user.username)
+        await db.flush()
+        srv = await get_one(db, models.Server, id, loading.plan(schemas.Server))
+        await search.index(db, "server", srv)
+        if "group_id" in diff:
+            # finance documents embed the server's group title
+            await search.reindex(db, "finance", models.Finance.server_id == id)
+        await rollups.move_servers(db, {id: diff})
+        add_log(db, id, "server", "Updated", history.format_diff(diff), current_user.username, diff)
+        await db.commit()
     return srv
 
+# History reads are always bounded (100 rows by default) and page through cursors;
+# archived=true reads rows already moved out of the hot table.
+HistoryLimit = Query(100, ge=1, le=pagination.MAX_LIMIT)
+
+async def history_response(db, response: Response, filters: dict, since: Optional[datetime], until: Optional[datetime], archived: bool, limit: int, cursor: Optional[str], format: Optional[str]):
+    model = models.HistoryArchive if archived else models.History
+    shape = serialize.shape(schemas.History, model)
+    query = shape.select().where(*[getattr(model, k) == v for k, v in filters.items() if v is not None])
+    if since:
+        query = query.where(model.timestamp >= since)
+    if until:
+        query = query.where(model.timestamp < until)
+    rows = await pagination.list_response(db, response, query, [model.timestamp, model.id], shape, limit, cursor, format, descending=True)
+    return pagination.json_response(response, rows)
+
+@app.get("/api/history", response_model=List[schemas.History])
+async def get_recent_history(response: Response, target_type: Optional[str] = None, target_id: Optional[int] = None, user: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None, archived: bool = False, limit: int = HistoryLimit, cursor: Optional[str] = None, format: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
+    filters = {"target_type": target_type, "target_id": target_id, "user": user}
+    return await history_response(db, response, filters, since, until, archived, limit, cursor, format)
+
 @app.get("/api/history/{type}/{id}", response_model=List[schemas.History])
-async def get_history(type: str, id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    return db.query(models.History).filter_by(target_type=type, target_id=id).order_by(models.History.timestamp.desc()).all()
+async def get_history(response: Response, type: str, id: int, since: Optional[datetime] = None, until: Optional[datetime] = None, archived: bool = False, limit: int = HistoryLimit, cursor: Optional[str] = None, format: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(get_current_user)):
+    return await history_response(db, response, {"target_type": type, "target_id": id}, since, until, archived, limit, cursor, format)
 
 @app.get("/api/domains", response_model=List[schemas.Domain])
-async def get_domains(q: Optional[str] = None, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    query = db.query(models.Domain)
-    if q:
-        query = query.filter(
-            models.Domain.name.ilike(f"%{q}%") |
-            models.Domain.group.has(models.Group.title.ilike(f"%{q}%"))
-        )
-    return query.all()
+async def get_domains(request: Request, response: Response, q: Optional[str] = None, limit: Optional[int] = Limit, cursor: Optional[str] = None, format: Optional[str] = None, fields: Optional[str] = None, include: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(get_current_user)):
+    shape = serialize.shape(schemas.Domain, only=serialize.projection(schemas.Domain, fields, include))
+    async def build():
+        query = shape.select()
+        if q:
+            return await search.ranked_response(db, query, "domain", q, limit, shape, format)
+        return await pagination.list_response(db, response, query, [models.Domain.id], shape, limit, cursor, format)
+    return await http_cache.cached_list(request, response, db, current_user.role, ("domains", "groups", "projects"), build)
 
 @app.post("/api/domains", response_model=schemas.Domain)
-async def add_domain(domain: schemas.DomainCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
+async def add_domain(domain: schemas.DomainCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
     dom = models.Domain(**domain.dict())
     db.add(dom)
-    db.commit()
-    db.refresh(dom)
+    await db.flush()
+    dom = await get_one(db, models.Domain, dom.id, loading.plan(schemas.Domain))
+    await search.index(db, "domain", dom)
     add_log(db, dom.id, "domain", "Created", f"Name: {dom.name}", current_user.username)
+    await db.commit()
     return dom
 
 @app.put("/api/domains/{id}", response_model=schemas.Domain)
-async def update_domain(id: int, domain_data: schemas.DomainCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]))):
-    dom = db.query(models.Domain).filter(models.Domain.id == id).first()
+async def update_domain(id: int, domain_data: schemas.DomainCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]))):
+    dom = await get_one(db, models.Domain, id, loading.plan(schemas.Domain))
     if not dom: raise HTTPException(status_code=404, detail="Domain not found")
 
     update_data = domain_data.dict(exclude_unset=True)
-    diff = []
-    for key, value in update_data.items():
-        if hasattr(dom, key) and getattr(dom, key) != value:
-            diff.append(f"{key}: {getattr(dom, key)} -> {value}")
-            setattr(dom, key, value)
+    diff = history.diff_changes(dom, update_data)
 
     if diff:
-        db.commit()
-        add_log(db, id, "domain", "Updated", " | ".join(diff), current_user.username)
+        await db.flush()
+        dom = await get_one(db, models.Domain, id, loading.plan(schemas.Domain))
+        await search.index(db, "domain", dom)
+        add_log(db, id, "domain", "Updated", history.format_diff(diff), current_user.username, diff)
+        await db.commit()
     return dom
 
+@app.post("/api/domains/refresh", response_model=schemas.DomainRefreshResult)
+async def refresh_domains(request: schemas.DomainRefresh = None, current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]))):
+    try:
+        return await dns_refresh.refresh(request.ids if request else None, current_user.username)
+    except jobs.AlreadyRunning:
+        raise HTTPException(status_code=409, detail="A DNS refresh is already running")
+
 @app.get("/api/projects", response_model=List[schemas.Project])
-async def get_projects(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    return db.query(models.Project).all()
+async def get_projects(request: Request, response: Response, fields: Optional[str] = None, include: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(get_current_user)):
+    shape = serialize.shape(schemas.Project, only=serialize.projection(schemas.Project, fields, include))
+    async def build():
+        return await serialize.fetch(db, shape, shape.select().order_by(models.Project.id))
+    return await http_cache.cached_list(request, response, db, current_user.role, ("projects",), build)
 
 @app.post("/api/projects", response_model=schemas.Project)
-async def add_project(project: schemas.ProjectCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
+async def add_project(project: schemas.ProjectCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
     proj = models.Project(**project.dict())
     db.add(proj)
-    db.commit()
-    db.refresh(proj)
+    await db.flush()
     add_log(db, proj.id, "project", "Created", f"Title: {proj.title}", current_user.username)
+    await db.commit()
     return proj
 
 @app.get("/api/groups", response_model=List[schemas.Group])
-async def get_groups(q: Optional[str] = None, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    query = db.query(models.Group)
-    if q:
-        query = query.filter(
-            models.Group.id.ilike(f"%{q}%") |
-            models.Group.title.ilike(f"%{q}%")
-        )
-    return query.all()
+async def get_groups(request: Request, response: Response, q: Optional[str] = None, limit: Optional[int] = Limit, cursor: Optional[str] = None, format: Optional[str] = None, fields: Optional[str] = None, include: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(get_current_user)):
+    shape = serialize.shape(schemas.Group, only=serialize.projection(schemas.Group, fields, include))
+    async def build():
+        query = shape.select()
+        if q:
+            return await search.ranked_response(db, query, "group", q, limit, shape, format)
+        return await pagination.list_response(db, response, query, [models.Group.id], shape, limit, cursor, format)
+    return await http_cache.cached_list(request, response, db, current_user.role, ("groups", "projects"), build)
+
+# Counts for the groups / projects views in one call (overview.py); spend only for roles that see finance
+@app.get("/api/overview", response_model=schemas.Overview)
+async def get_overview(request: Request, response: Response, month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"), db=Depends(get_read_db), current_user: schemas.Principal = Depends(get_current_user)):
+    month = month or datetime.utcnow().strftime("%Y-%m")
+    finance = current_user.role in ("Super Admin", "Admin 2L")
+    async def build():
+        return await overview.build(db, month, finance)
+    tables = ("groups", "projects", "servers", "domains", "finance_rollups")
+    return await http_cache.cached_list(request, response, db, current_user.role, tables, build, vary=(month,))
 
 @app.post("/api/groups", response_model=schemas.Group)
-async def add_group(group: schemas.GroupCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
+async def add_group(group: schemas.GroupCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
     grp = models.Group(**group.dict())
     db.add(grp)
-    db.commit()
-    db.refresh(grp)
+    await db.flush()
+    grp = await get_one(db, models.Group, grp.id, loading.plan(schemas.Group))
+    await search.index(db, "group", grp)
     add_log(db, grp.id, "group", "Created", f"Title: {grp.title}", current_user.username)
+    await db.commit()
     return grp
 
 @app.put("/api/groups/{id}", response_model=schemas.Group)
-async def update_group(id: int, group_data: schemas.GroupCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]))):
-    grp = db.query(models.Group).filter(models.Group.id == id).first()
+async def update_group(id: int, group_data: schemas.GroupCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Admin 1L", "Service Manager"]))):
+    grp = await get_one(db, models.Group, id, loading.plan(schemas.Group))
     if not grp: raise HTTPException(status_code=404, detail="Group not found")
 
     update_data = group_data.dict(exclude_unset=True)
-    diff = []
-    for key, value in update_data.items():
-        if hasattr(grp, key) and getattr(grp, key) != value:
-            diff.append(f"{key}: {getattr(grp, key)} -> {value}")
-            setattr(grp, key, value)
+    diff = history.diff_changes(grp, update_data)
 
     if diff:
-        db.commit()
-        add_log(db, id, "group", "Updated", " | ".join(diff), current_user.username)
+        await db.flush()
+        grp = await get_one(db, models.Group, id, loading.plan(schemas.Group))
+        await search.index(db, "group", grp)
+        if "title" in diff:
+            await search.reindex_group_members(db, id)
+        add_log(db, id, "group", "Updated", history.format_diff(diff), current_user.username, diff)
+        await db.commit()
     return grp
 
 @app.get("/api/finance", response_model=List[schemas.Finance])
-async def get_finance_records(q: Optional[str] = None, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
-    query = db.query(models.Finance)
-    if q:
-        query = query.join(models.Server).join(models.Group).filter(
-            models.Finance.id.ilike(f"%{q}%") |
-            models.Finance.server_id.ilike(f"%{q}%") |
-            models.Finance.payment_date.ilike(f"%{q}%") |
-            models.Group.title.ilike(f"%{q}%")
-        )
-    return query.all()
+async def get_finance_records(request: Request, response: Response, q: Optional[str] = None, limit: Optional[int] = Limit, cursor: Optional[str] = None, format: Optional[str] = None, fields: Optional[str] = None, include: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
+    shape = serialize.shape(schemas.Finance, only=serialize.projection(schemas.Finance, fields, include))
+    async def build():
+        query = shape.select()
+        if q:
+            return await search.ranked_response(db, query, "finance", q, limit, shape, format)
+        return await pagination.list_response(db, response, query, [models.Finance.id], shape, limit, cursor, format)
+    return await http_cache.cached_list(request, response, db, current_user.role, ("finance", "servers", "groups", "projects", "server_probes"), build)
+
+@app.get("/api/finance/analytics", response_model=schemas.FinanceAnalytics)
+async def get_finance_analytics(since: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"), until: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"), by: Optional[List[str]] = Query(None), db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
+    dimensions = by or list(rollups.DIMENSIONS)
+    if not set(dimensions) <= set(rollups.DIMENSIONS):
+        raise HTTPException(status_code=400, detail=f"by must be one of {', '.join(rollups.DIMENSIONS)}")
+    return await rollups.analytics(db, since, until, dimensions)
 
 @app.post("/api/finance", response_model=schemas.Finance)
-async def add_finance_record(record: schemas.FinanceCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
+async def add_finance_record(record: schemas.FinanceCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L", "Service Manager"]))):
     fin = models.Finance(**record.dict())
     db.add(fin)
-    db.commit()
-    db.refresh(fin)
+    await db.flush()
+    fin = await get_one(db, models.Finance, fin.id, loading.plan(schemas.Finance))
+    await search.index(db, "finance", fin)
+    await rollups.apply_change(db, added=rollups.contributions(fin))
     add_log(db, fin.id, "finance", "Created", f"Server ID: {fin.server_id}, Price: {fin.price}", current_user.username)
+    await db.commit()
     return fin
 
 @app.put("/api/finance/{id}", response_model=schemas.Finance)
-async def update_finance_record(id: int, record_data: schemas.FinanceCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
-    fin = db.query(models.Finance).filter(models.Finance.id == id).first()
+async def update_finance_record(id: int, record_data: schemas.FinanceCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
+    # locked until commit: `before` must be what a concurrent update left, not what it replaced
+    fin = await get_one(db, models.Finance, id, loading.plan(schemas.Finance), lock=True)
     if not fin: raise HTTPException(status_code=404, detail="Finance record not found")
 
     update_data = record_data.dict(exclude_unset=True)
-    diff = []
-    for key, value in update_data.items():
-        if hasattr(fin, key) and getattr(fin, key) != value:
-            diff.append(f"{key}: {getattr(fin, key)} -> {value}")
-            setattr(fin, key, value)
+    before = rollups.contributions(fin)
+    diff = history.diff_changes(fin, update_data)
 
     if diff:
-        db.commit()
-        add_log(db, id, "finance", "Updated", " | ".join(diff), current_user.username)
+        await db.flush()
+        fin = await get_one(db, models.Finance, id, loading.plan(schemas.Finance))
+        await search.index(db, "finance", fin)
+        await rollups.apply_change(db, before, rollups.contributions(fin))
+        add_log(db, id, "finance", "Updated", history.format_diff(diff), current_user.username, diff)
+        await db.commit()
     return fin
 
 @app.get("/api/users", response_model=List[schemas.User])
-async def get_users(q: Optional[str] = None, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
-    query = db.query(models.User)
-    if q:
-        query = query.filter(
-            models.User.username.ilike(f"%{q}%") |
-            models.User.email.ilike(f"%{q}%") |
-            models.User.number.ilike(f"%{q}%") |
-            models.User.role.ilike(f"%{q}%")
-        )
-    return query.all()
+async def get_users(request: Request, response: Response, q: Optional[str] = None, limit: Optional[int] = Limit, cursor: Optional[str] = None, format: Optional[str] = None, fields: Optional[str] = None, include: Optional[str] = None, db=Depends(get_read_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
+    shape = serialize.shape(schemas.User, only=serialize.projection(schemas.User, fields, include))
+    async def build():
+        query = shape.select()
+        if q:
+            return await search.ranked_response(db, query, "user", q, limit, shape, format)
+        return await pagination.list_response(db, response, query, [models.User.id], shape, limit, cursor, format)
+    return await http_cache.cached_list(request, response, db, current_user.role, ("users",), build)
 
 @app.post("/api/users", response_model=schemas.User)
-async def add_user(user: schemas.UserCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
-    hashed_password = get_password_hash(user.password)
+async def add_user(user: schemas.UserCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
+    hashed_password = await passwords.hash_password(user.password)
     new_user = models.User(
         username=user.username,
         email=user.email,
@@ -304,43 +453,108 @@ async def add_user(user: schemas.UserCreate, db: Session = Depends(database.get_
         number=user.number
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.flush()
+    await search.index(db, "user", new_user)
     add_log(db, new_user.id, "user", "Created", f"Username: {new_user.username}", current_user.username)
+    await db.commit()
     return new_user
 
 @app.put("/api/users/{id}", response_model=schemas.User)
-async def update_user(id: int, user_data: schemas.UserUpdate, db: Session = Depends(database.get_db), current_user: models.User = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
-    usr = db.query(models.User).filter(models.User.id == id).first()
+async def update_user(id: int, user_data: schemas.UserUpdate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(RoleChecker(["Super Admin", "Admin 2L"]))):
+    usr = await get_one(db, models.User, id)
     if not usr: raise HTTPException(status_code=404, detail="User not found")
 
     update_data = user_data.dict(exclude_unset=True)
     if "password" in update_data and update_data["password"]:
-        update_data["hashed_password"] = get_password_hash(update_data.pop("password"))
+        update_data["hashed_password"] = await passwords.hash_password(update_data.pop("password"))
 
-    diff = []
-    for key, value in update_data.items():
-        if hasattr(usr, key) and getattr(usr, key) != value:
-            diff.append(f"{key}: {getattr(usr, key)} -> {value}")
-            setattr(usr, key, value)
+    old_username = usr.username
+    diff = history.diff_changes(usr, update_data)
 
     if diff:
-        db.commit()
-        add_log(db, id, "user", "Updated", " | ".join(diff), current_user.username)
+        await search.index(db, "user", usr)
+        add_log(db, id, "user", "Updated", history.format_diff(diff), current_user.username, diff)
+        await db.commit()
+        invalidate_principal(old_username, usr.username)
     return usr
 
+# --- Bulk import / export (CSV or NDJSON) ---
+@app.post("/api/import/{entity}")
+async def import_records(entity: str, file: UploadFile = File(...), format: Optional[str] = None, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(get_current_user)):
+    spec = bulk.get_entity(entity, current_user)
+    return await bulk.import_file(db, spec, file, format, current_user.username)
+
+@app.get("/api/export/{entity}")
+async def export_records(entity: str, format: Optional[str] = None, current_user: schemas.Principal = Depends(get_current_user)):
+    return bulk.export(bulk.get_entity(entity, current_user, "export"), format)
+
+# Batch update: PATCH /api/servers {"ids": [...] and/or "where": {"group_id": 3}, "values": {"status": "Stopped"}}
+@app.patch("/api/{entity}", response_model=schemas.BatchUpdateResult)
+async def batch_update(entity: str, request: schemas.BatchUpdate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(get_current_user)):
+    spec = bulk.get_entity(entity, current_user, "update")
+    return await bulk.update_rows(db, spec, request, current_user.username)
+
+# --- Live change feed (Server-Sent Events) ---
+# EventSource cannot send headers and query strings end up in access logs, so the stream is
+# opened with a ticket from POST /api/changes/ticket - valid FEED_TICKET_SECONDS and only
+# for /api/changes - instead of the access token; ?types=server,domain narrows the stream.
+# It ends when the access token expires or the user is suspended or changes role;
+# clients get a new ticket, reconnect and reload what they show.
+FEED_TICKET_SECONDS = 30
+FEED_SCOPE = "changes"
+
+@app.post("/api/changes/ticket", response_model=schemas.FeedTicket)
+async def change_feed_ticket(token: str = Depends(oauth2_scheme), current_user: schemas.Principal = Depends(get_current_user)):
+    claims = {"sub": current_user.username, "scope": FEED_SCOPE, "until": jwt.get_unverified_claims(token)["exp"]}
+    ticket = create_access_token(claims, timedelta(seconds=FEED_TICKET_SECONDS))
+    return {"ticket": ticket, "expires_in": FEED_TICKET_SECONDS}
+
+@app.get("/api/changes")
+async def change_feed(ticket: str, types: Optional[str] = None):
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        payload = {}
+    if payload.get("scope") != FEED_SCOPE or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid or expired feed ticket")
+
+    async def current() -> Optional[schemas.Principal]:
+        # re-read on every heartbeat, so suspensions and role changes end the stream
+        db = database.new_async_session()
+        try:
+            return await load_principal(db, payload["sub"])
+        finally:
+            await db.close()
+
+    user = await current()
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired feed ticket")
+    if user.status != "active":
+        raise HTTPException(status_code=403, detail=f"User account is {user.status}")
+    return feed.stream(user, [t for t in (types or "").split(",") if t], payload["until"], current)
+
 @app.get("/api/settings/me", response_model=schemas.User)
-async def get_my_settings(current_user: models.User = Depends(get_current_user)):
-    return current_user
+async def get_my_settings(db=Depends(get_read_db), current_user: schemas.Principal = Depends(get_current_user)):
+    return await get_one(db, models.User, current_user.id)
 
 @app.put("/api/settings/me", response_model=schemas.User)
-async def update_my_settings(user_data: schemas.UserCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+async def update_my_settings(user_data: schemas.UserCreate, db=Depends(database.get_async_db), current_user: schemas.Principal = Depends(get_current_user)):
+    user = await get_one(db, models.User, current_user.id)
     update_data = user_data.dict(exclude_unset=True)
     if "password" in update_data:
-        current_user.hashed_password = get_password_hash(update_data.pop("password"))
+        user.hashed_password = await passwords.hash_password(update_data.pop("password"))
 
     for key, value in update_data.items():
-        setattr(current_user, key, value)
+        setattr(user, key, value)
+
+    await search.index(db, "user", user)
+    await db.commit()
+    invalidate_principal(current_user.username, user.username)
+    return user
 
-    db.commit()
-    return current_user
+# --- Metrics (Prometheus text format) ---
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    if metrics.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
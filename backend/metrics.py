@@ -0,0 +1,241 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Process-local metrics in Prometheus text format (GET /metrics): per-route latency and
+# status codes, SQL statements per request and their time (engine cursor events), pool
+# checkout wait and saturation, bcrypt time, plus gauges other modules register.
+# With SLOW_REQUEST_MS > 0 every request slower than that is logged together with the
+# statements it ran. Each worker process keeps its own numbers - scrape every worker.
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_MAX_STATEMENTS = 50
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # when set, /metrics wants "Authorization: Bearer <token>"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+class Gauge(_Metric):
+    """Read when scraped: `fn` returns a number, or {label values tuple: number} for labelled
+    gauges. kind="counter" exposes a monotonic value kept elsewhere as a counter."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn, labels=(), kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def _samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            logger.exception("gauge %s failed", self.name)
+            return
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(v)}"
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._values.items())
+        for labels, (counts, count, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.label_names, labels, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {count}"
+
+_registry = []
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+http_requests = Counter("http_requests_total", "Finished HTTP requests.", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "Time to produce and send the full response.", ("method", "route"))
+http_statements = Histogram("http_request_db_statements", "SQL statements executed per request.", ("method", "route"), COUNT_BUCKETS)
+http_db_time = Histogram("http_request_db_seconds", "Time spent in SQL statements per request.", ("method", "route"))
+db_statements = Counter("db_statements_total", "SQL statements executed, including background jobs.")
+db_errors = Counter("db_statement_errors_total", "SQL statements that raised.")
+db_latency = Histogram("db_statement_duration_seconds", "Duration of single SQL statements.")
+pool_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.", ("engine",))
+password_time = Histogram("password_hash_seconds", "bcrypt time per operation, excluding queueing.", ("operation",), (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+# --- Per-request accounting ---
+# The stats object is mutable, so statements run on threadpool threads (sync mode) or in
+# SQLAlchemy's greenlets (async mode) - both inherit the request's context - add to it.
+class RequestStats:
+    __slots__ = ("statements", "db_seconds", "log")
+
+    def __init__(self, log: bool):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.log = [] if log else None
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    elapsed = time.perf_counter() - started if started is not None else 0.0
+    db_statements.inc()
+    db_latency.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+        if stats.log is not None and len(stats.log) < SLOW_REQUEST_MAX_STATEMENTS:
+            # statement text only - parameters may hold passwords
+            stats.log.append((elapsed, statement))
+
+def _handle_error(exception_context):
+    db_errors.inc()
+
+def timed_pool(pool_class, name: str):
+    """Subclass of `pool_class` that records how long each checkout waits for a connection."""
+    class TimedPool(pool_class):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                pool_wait.observe(time.perf_counter() - started, name)
+
+    TimedPool.__name__ = "Timed" + pool_class.__name__
+    return TimedPool
+
+_engines = {}
+
+def instrument_engine(engine, name: str):
+    """Attaches statement timing to `engine` (a sync Engine, or AsyncEngine.sync_engine)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    _engines[name] = engine
+
+def _pool_stat(method):
+    def read():
+        # engine.pool, not a saved reference: dispose() swaps the pool
+        return {(name,): getattr(engine.pool, method)() for name, engine in _engines.items() if hasattr(engine.pool, method)}
+    return read
+
+Gauge("db_pool_checked_out", "Connections currently checked out.", _pool_stat("checkedout"), ("engine",))
+Gauge("db_pool_size", "Configured pool size.", _pool_stat("size"), ("engine",))
+Gauge("db_pool_overflow", "Connections open beyond pool size (negative: unused headroom).", _pool_stat("overflow"), ("engine",))
+
+# --- Middleware ---
+def _route(scope) -> str:
+    # the route template keeps label cardinality bounded (/api/servers/{id}, not every id)
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(log=SLOW_REQUEST_MS > 0)
+        token = _current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - started
+            method, route = scope["method"], _route(scope)
+            http_requests.inc(method, route, str(status))
+            http_latency.observe(elapsed, method, route)
+            http_statements.observe(stats.statements, method, route)
+            http_db_time.observe(stats.db_seconds, method, route)
+            if stats.log is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+                _log_slow(scope, status, elapsed, stats)
+
+def _log_slow(scope, status, elapsed, stats):
+    lines = [f"  {seconds * 1000:8.1f} ms  {' '.join(statement.split())[:500]}" for seconds, statement in stats.log]
+    if stats.statements > len(stats.log):
+        lines.append(f"  ... {stats.statements - len(stats.log)} more")
+    logger.warning(
+        "slow request %s %s -> %d in %.0f ms, %d statements, %.0f ms in SQL\n%s",
+        scope["method"], scope["path"], status, elapsed * 1000, stats.statements, stats.db_seconds * 1000, "\n".join(lines),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, ForeignKey, UniqueConstraint, Index, JSON
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -31,8 +31,18 @@ class Server(Base):
     cont_pass = Column(String, default="")
     ssh_port = Column(Integer, default=22)
 
-    group = relationship("Group", back_populates="servers")
-    project = relationship("Project")
+    group = relationship("Group", back_populates="servers", lazy="raise_on_sql")
+    project = relationship("Project", lazy="raise_on_sql")
+    probe = relationship("ServerProbe", uselist=False, viewonly=True, lazy="raise_on_sql")
+
+# last TCP check of each server's SSH port, written by probe.py
+class ServerProbe(Base):
+    __tablename__ = "server_probes"
+    server_id = Column(Integer, ForeignKey("servers.id"), primary_key=True)
+    state = Column(String, nullable=False)  # up / timeout / refused / unreachable
+    latency_ms = Column(Float, nullable=True)  # connect time when up
+    checked_at = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=True)  # last check that found it up
 
 class Domain(Base):
     __tablename__ = "domains"
@@ -44,14 +54,14 @@ class Domain(Base):
     a_record = Column(String, nullable=True)
     aaaa_record = Column(String, nullable=True)
 
-    group = relationship("Group", back_populates="domains")
+    group = relationship("Group", back_populates="domains", lazy="raise_on_sql")
 
 class Project(Base):
     __tablename__ = "projects"
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, unique=True, index=True)
 
-    groups = relationship("Group", back_populates="project")
+    groups = relationship("Group", back_populates="project", lazy="raise_on_sql")
 
 class Group(Base):
     __tablename__ = "groups"
@@ -61,9 +71,9 @@ class Group(Base):
     status = Column(String, default="Enabled")
     description = Column(Text, nullable=True)
 
-    project = relationship("Project", back_populates="groups")
-    servers = relationship("Server", back_populates="group")
-    domains = relationship("Domain", back_populates="group")
+    project = relationship("Project", back_populates="groups", lazy="raise_on_sql")
+    servers = relationship("Server", back_populates="group", lazy="raise_on_sql")
+    domains = relationship("Domain", back_populates="group", lazy="raise_on_sql")
 
 class Finance(Base):
     __tablename__ = "finance"
@@ -73,14 +83,53 @@ class Finance(Base):
     account_status = Column(String)
     payment_date = Column(DateTime)
 
-    server = relationship("Server")
+    server = relationship("Server", lazy="raise_on_sql")
 
-class History(Base):
-    __tablename__ = "history"
+class HistoryColumns:
     id = Column(Integer, primary_key=True, index=True)
     target_id = Column(Integer)
     target_type = Column(String)
     user = Column(String)
     action = Column(String)
     changes = Column(Text)
+    diff = Column(JSON, nullable=True)  # {"field": [old, new]}
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+
+class History(HistoryColumns, Base):
+    __tablename__ = "history"
+    __table_args__ = (
+        Index("ix_history_target", "target_type", "target_id", "timestamp"),
+        Index("ix_history_timestamp", "timestamp"),
+    )
+
+# rows older than HISTORY_RETENTION_DAYS are moved here out of the hot table
+class HistoryArchive(HistoryColumns, Base):
+    __tablename__ = "history_archive"
+    __table_args__ = (
+        Index("ix_history_archive_target", "target_type", "target_id", "timestamp"),
+        Index("ix_history_archive_timestamp", "timestamp"),
+    )
+
+class SearchDocument(Base):
+    __tablename__ = "search_documents"
+    id = Column(Integer, primary_key=True)
+    target_type = Column(String, nullable=False)
+    target_id = Column(Integer, nullable=False)
+    document = Column(Text, nullable=False, default="")
+
+    __table_args__ = (UniqueConstraint("target_type", "target_id"),)
+
+# bumped in the same transaction as every write to the table (see versions.py)
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# monthly finance totals per dimension, maintained incrementally by rollups.py
+class FinanceRollup(Base):
+    __tablename__ = "finance_rollups"
+    month = Column(String, primary_key=True)  # "YYYY-MM" of payment_date
+    dimension = Column(String, primary_key=True)  # group / project / hoster / country / account_status
+    key = Column(String, primary_key=True)
+    total = Column(Float, nullable=False, default=0.0)
+    records = Column(Integer, nullable=False, default=0)
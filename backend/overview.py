@@ -0,0 +1,82 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+import models
+
+# Per-group and per-project counts for the groups / projects views: servers and domains
+# by status and one month's finance spend. Five statements whatever the number of
+# groups - the group and project rows, one GROUP BY each over servers and domains, and
+# the month's finance_rollups rows - instead of loading Group.servers / Group.domains.
+# Servers count towards their own project_id, domains (which have none) towards their
+# group's project. Spend comes from the rollups, attributed to the server's current
+# group / project.
+
+def _counts(finance: bool):
+    spend, records = (0.0, 0) if finance else (None, None)
+    return {"servers": 0, "servers_by_status": {}, "domains": 0, "domains_by_status": {}, "finance_total": spend, "finance_records": records}
+
+def _add(counts, kind: str, status, n: int):
+    counts[kind] += n
+    by_status = counts[f"{kind}_by_status"]
+    status = status or ""
+    by_status[status] = by_status.get(status, 0) + n
+
+async def build(db, month: str = None, finance: bool = True) -> dict:
+    """Overview for `month` (YYYY-MM, the current one by default); `finance` False leaves
+    the spend fields null for roles that can't see finance."""
+    month = month or datetime.utcnow().strftime("%Y-%m")
+    groups = (await db.execute(select(models.Group.id, models.Group.title, models.Group.status, models.Group.project_id).order_by(models.Group.id))).all()
+    projects = (await db.execute(select(models.Project.id, models.Project.title).order_by(models.Project.id))).all()
+    servers = (await db.execute(
+        select(models.Server.group_id, models.Server.project_id, models.Server.status, func.count())
+        .group_by(models.Server.group_id, models.Server.project_id, models.Server.status)
+    )).all()
+    domains = (await db.execute(
+        select(models.Domain.group_id, models.Domain.status, func.count()).group_by(models.Domain.group_id, models.Domain.status)
+    )).all()
+
+    totals = _counts(finance)
+    by_group = defaultdict(lambda: _counts(finance))
+    by_project = defaultdict(lambda: _counts(finance))
+    group_project = {g.id: g.project_id for g in groups}
+    for group_id, project_id, status, n in servers:
+        _add(totals, "servers", status, n)
+        _add(by_group[group_id], "servers", status, n)
+        _add(by_project[project_id], "servers", status, n)
+    for group_id, status, n in domains:
+        _add(totals, "domains", status, n)
+        _add(by_group[group_id], "domains", status, n)
+        _add(by_project[group_project.get(group_id)], "domains", status, n)
+
+    if finance:
+        table = models.FinanceRollup
+        rollups = (await db.execute(
+            select(table.dimension, table.key, table.total, table.records)
+            .where(table.month == month, table.dimension.in_(("group", "project")))
+        )).all()
+        for dimension, key, total, records in rollups:
+            counts = (by_group if dimension == "group" else by_project)[int(key) if key else None]
+            counts["finance_total"] = round(counts["finance_total"] + total, 2)
+            counts["finance_records"] += records
+            if dimension == "group":
+                # every record has exactly one group row (key "" when ungrouped)
+                totals["finance_total"] = round(totals["finance_total"] + total, 2)
+                totals["finance_records"] += records
+
+    groups_in = Counter(g.project_id for g in groups)
+    return {
+        "month": month,
+        "totals": totals,
+        "projects": [
+            {"id": p.id, "title": p.title, "groups": groups_in[p.id], **by_project[p.id]}
+            for p in projects
+        ],
+        "groups": [
+            {"id": g.id, "title": g.title, "status": g.status, "project_id": g.project_id, **by_group[g.id]}
+            for g in groups
+        ],
+        # servers / domains / spend outside any group or project
+        "unassigned": {"group": by_group[None], "project": by_project[None]},
+    }
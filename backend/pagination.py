@@ -0,0 +1,92 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import DateTime, Integer, and_, or_
+
+import database, serialize
+
+MAX_LIMIT = 1000
+STREAM_BATCH_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _cursor_value(column, value):
+    # cursors come from the client: check every value against its column's type so a
+    # forged one is a 400 here rather than a driver error
+    if isinstance(column.type, DateTime):
+        if not isinstance(value, str):
+            raise ValueError(value)
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Integer) and (not isinstance(value, int) or isinstance(value, bool)):
+        raise ValueError(value)
+    return value
+
+def decode_cursor(cursor: str, columns):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [_cursor_value(c, v) for c, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _after(columns, values, descending: bool):
+    # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y) - portable row-value comparison
+    clauses = []
+    for i, column in enumerate(columns):
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], step))
+    return or_(*clauses)
+
+def keyset(query, columns, cursor: Optional[str] = None, limit: Optional[int] = None, descending: bool = False):
+    """Orders `query` by `columns` and continues after `cursor`; `columns` must be unique together."""
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+    if cursor:
+        query = query.where(_after(columns, decode_cursor(cursor, columns), descending))
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def stream_ndjson(query, shape):
+    """Streams rows as NDJSON straight from a server-side cursor, STREAM_BATCH_SIZE rows at a time.
+    Uses its own session because the response body outlives the request dependencies."""
+    make = shape.build
+
+    async def lines():
+        db = database.new_async_session()
+        try:
+            result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for row in result:
+                yield serialize.dumps(make(row)) + b"\n"
+        finally:
+            await db.close()
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def list_response(db, response: Response, query, columns, shape, limit: Optional[int], cursor: Optional[str], format: Optional[str], descending: bool = False):
+    """Runs `shape`'s select() query one keyset page at a time; returns dicts ready for
+    serialize.dumps(), or a streaming response for format=ndjson."""
+    if format not in (None, "json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    query = keyset(query, columns, cursor, limit, descending)
+    if format == "ndjson":
+        return stream_ndjson(query, shape)
+    rows = await serialize.fetch(db, shape, query)
+    if limit and len(rows) == limit:
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([last[c.key] for c in columns])
+    return rows
+
+def json_response(response: Response, rows) -> Response:
+    """Encodes list_response() rows, keeping the headers it set (X-Next-Cursor)."""
+    if isinstance(rows, Response):
+        return rows
+    headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-length", "content-type")}
+    return Response(content=serialize.dumps(rows), media_type="application/json", headers=headers)
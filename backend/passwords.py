@@ -0,0 +1,53 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+import metrics
+
+# bcrypt is deliberately slow (~100ms+ per call at the default cost), so hashing and
+# verification run on a small dedicated pool instead of the event loop. The bcrypt
+# extension releases the GIL, so threads give real parallelism. When more than
+# PASSWORD_QUEUE_LIMIT calls are already waiting, new ones are refused immediately
+# (429 on login, 503 elsewhere) rather than piling up behind a login burst.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get("PASSWORD_QUEUE_LIMIT", "32"))
+
+# hashes made with a different cost are reported by verify_and_update and rehashed on login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_in_flight = 0
+
+def in_flight() -> int:
+    return _in_flight
+
+metrics.Gauge("password_operations_in_flight", "bcrypt calls running or queued.", in_flight)
+
+def _timed(operation: str, fn, *args):
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        metrics.password_time.observe(time.perf_counter() - started, operation)
+
+async def _run(busy_status: int, operation: str, fn, *args):
+    global _in_flight
+    if _in_flight >= PASSWORD_WORKERS + PASSWORD_QUEUE_LIMIT:
+        raise HTTPException(status_code=busy_status, detail="Too many password operations in progress, retry shortly", headers={"Retry-After": "1"})
+    _in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, _timed, operation, fn, *args)
+    finally:
+        _in_flight -= 1
+
+async def verify_and_update(plain_password, hashed_password):
+    """Returns (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+    return await _run(429, "verify", pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def hash_password(password):
+    return await _run(503, "hash", pwd_context.hash, password)
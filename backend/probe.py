@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, update
+
+import database, jobs, metrics, models
+
+logger = logging.getLogger(__name__)
+
+# TCP reachability of every server's SSH port (ip:ssh_port). A check is a plain connect
+# with a PROBE_TIMEOUT deadline - the socket is reset as soon as it opens, nothing is
+# read or sent. At most PROBE_CONCURRENCY connects are in flight; each waits a random
+# 0..PROBE_JITTER seconds first so a sweep doesn't go out as one SYN burst. Results are
+# upserted into server_probes (one row per server) and served as Server.probe. One
+# sweep runs at a time across all workers (jobs.Job).
+PROBE_INTERVAL = float(os.environ.get("PROBE_INTERVAL", "300"))  # 0 disables the background sweep
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", "500"))
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", "2.0"))
+PROBE_JITTER = float(os.environ.get("PROBE_JITTER", "0.1"))
+WRITE_BATCH = 1000
+
+checks = metrics.Counter("probe_checks_total", "SSH port checks by resulting state.", ("state",))
+sweeps = metrics.Counter("probe_sweeps_total", "Probe sweeps by trigger.", ("trigger",))
+_last = {"seconds": 0.0}
+metrics.Gauge("probe_last_sweep_seconds", "Duration of the last probe sweep.", lambda: _last["seconds"])
+
+async def check(host: str, port: int, timeout: float = PROBE_TIMEOUT):
+    """(state, latency_ms) of one TCP connect."""
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except asyncio.TimeoutError:
+        return "timeout", None
+    except ConnectionRefusedError:
+        return "refused", None
+    except (OSError, ValueError):
+        return "unreachable", None
+    latency = (time.perf_counter() - started) * 1000
+    writer.transport.abort()
+    return "up", round(latency, 2)
+
+async def _probe(semaphore, row):
+    async with semaphore:
+        if PROBE_JITTER:
+            await asyncio.sleep(random.uniform(0, PROBE_JITTER))
+        state, latency = await check(row.ip.strip(), row.ssh_port or 22)
+    checks.inc(state)
+    return state, latency
+
+async def _store(db, rows):
+    table = models.ServerProbe
+    upsert = database.upsert_insert()
+    if upsert is not None:
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.server_id],
+            set_={
+                "state": stmt.excluded.state, "latency_ms": stmt.excluded.latency_ms, "checked_at": stmt.excluded.checked_at,
+                "last_seen": func.coalesce(stmt.excluded.last_seen, table.last_seen),
+            },
+        )
+        await db.execute(stmt, rows)
+        return
+    for row in rows:
+        values = {k: v for k, v in row.items() if k != "server_id" and (k != "last_seen" or v is not None)}
+        result = await db.execute(update(table).where(table.server_id == row["server_id"]).values(**values))
+        if result.rowcount == 0:
+            await db.execute(insert(table).values(**row))
+
+async def sweep(ids=None, trigger: str = "manual") -> dict:
+    """Probes the given servers (all when `ids` is None) and stores the results;
+    jobs.AlreadyRunning if a sweep is running in any worker."""
+    async with prober.exclusive():
+        started = time.perf_counter()
+        sweeps.inc(trigger)
+        query = select(models.Server.id, models.Server.ip, models.Server.ssh_port).where(models.Server.ip.is_not(None), models.Server.ip != "")
+        if ids is not None:
+            query = query.where(models.Server.id.in_(ids))
+        db = database.new_async_session()
+        try:
+            servers = (await db.execute(query.order_by(models.Server.id))).all()
+        finally:
+            await db.close()
+        semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+        results = await asyncio.gather(*[_probe(semaphore, row) for row in servers])
+
+        now = datetime.utcnow()
+        rows = [
+            {"server_id": row.id, "state": state, "latency_ms": latency, "checked_at": now, "last_seen": now if state == "up" else None}
+            for row, (state, latency) in zip(servers, results)
+        ]
+        db = database.new_async_session()
+        try:
+            for i in range(0, len(rows), WRITE_BATCH):
+                await _store(db, rows[i:i + WRITE_BATCH])
+            await db.commit()
+        finally:
+            await db.close()
+        _last["seconds"] = time.perf_counter() - started
+        up = sum(1 for state, _ in results if state == "up")
+        return {"servers": len(rows), "up": up, "down": len(rows) - up, "seconds": round(_last["seconds"], 3)}
+
+async def summary(db) -> dict:
+    table = models.ServerProbe
+    servers = await db.scalar(select(func.count()).select_from(models.Server))
+    states = (await db.execute(
+        select(table.state, func.count(), func.avg(table.latency_ms), func.max(table.latency_ms),
+               func.min(table.checked_at), func.max(table.checked_at))
+        .group_by(table.state).order_by(table.state)
+    )).all()
+    return {
+        "servers": servers,
+        "probed": sum(s[1] for s in states),
+        "states": [
+            {"state": state, "servers": count, "avg_latency_ms": None if avg is None else round(avg, 2), "max_latency_ms": top}
+            for state, count, avg, top, _, _ in states
+        ],
+        "oldest_check": min((s[4] for s in states), default=None),
+        "newest_check": max((s[5] for s in states), default=None),
+    }
+
+async def _scheduled():
+    result = await sweep(trigger="scheduled")
+    logger.info("probe sweep: %(servers)d servers, %(up)d up, %(down)d down in %(seconds).1fs", result)
+
+prober = jobs.Job("probe_sweep", PROBE_INTERVAL, _scheduled)
@@ -0,0 +1,145 @@
+from collections import defaultdict
+
+from sqlalchemy import delete, insert, select, update
+
+import database, loading, models, schemas
+
+# Finance aggregates kept in finance_rollups: for every month, the spend and record
+# count per group, project, hoster, country and account_status. Writes apply the
+# difference of the affected records, so reads never touch the finance table.
+# Spend is attributed to the server's current group/project/hoster/country: changing a
+# server moves its records' contributions (move_servers), so incremental updates agree
+# with rebuild(), which recomputes everything from scratch.
+DIMENSIONS = ("group", "project", "hoster", "country", "account_status")
+
+# dimension -> Server column it is read from
+SERVER_DIMENSIONS = {"group": "group_id", "project": "project_id", "hoster": "hoster", "country": "country"}
+
+def contributions(fin):
+    """[((month, dimension, key), price)] a finance record adds; `fin.server` must be loaded.
+    Take it before modifying the record to know what to subtract afterwards."""
+    if fin.payment_date is None:
+        return []
+    month = fin.payment_date.strftime("%Y-%m")
+    server = fin.server
+    keys = {
+        "group": server.group_id if server else None,
+        "project": server.project_id if server else None,
+        "hoster": server.hoster if server else None,
+        "country": server.country if server else None,
+        "account_status": fin.account_status,
+    }
+    return [((month, dimension, "" if key is None else str(key)), fin.price or 0.0) for dimension, key in keys.items()]
+
+async def _apply(db, deltas):
+    table = models.FinanceRollup
+    upsert = database.upsert_insert()
+    rows = [
+        dict(month=month, dimension=dimension, key=key, total=total, records=records)
+        for (month, dimension, key), (total, records) in deltas.items() if total or records
+    ]
+    if not rows:
+        return
+    if upsert is not None:
+        # one executemany for the whole batch - an import touches thousands of keys
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.month, table.dimension, table.key],
+            set_={"total": table.total + stmt.excluded.total, "records": table.records + stmt.excluded.records},
+        )
+        await db.execute(stmt, rows)
+        return
+    for row in rows:
+        result = await db.execute(
+            update(table).where(table.month == row["month"], table.dimension == row["dimension"], table.key == row["key"])
+            .values(total=table.total + row["total"], records=table.records + row["records"])
+        )
+        if result.rowcount == 0:
+            await db.execute(insert(table).values(**row))
+
+def _add(deltas, items, sign):
+    for key, price in items:
+        total, records = deltas[key]
+        deltas[key] = (total + sign * price, records + sign)
+
+async def apply_change(db, removed=(), added=()):
+    """Subtracts the `removed` contributions and adds the `added` ones in the current transaction."""
+    deltas = defaultdict(lambda: (0.0, 0))
+    _add(deltas, removed, -1)
+    _add(deltas, added, +1)
+    await _apply(db, deltas)
+
+async def move_servers(db, diffs: dict):
+    """Re-attributes the finance records of changed servers. `diffs` is {server_id:
+    {column: [old, new]}} as returned by history.diff_changes; call it in the same
+    transaction as the server update."""
+    moved = {id: {d: diff[c] for d, c in SERVER_DIMENSIONS.items() if c in diff} for id, diff in diffs.items()}
+    moved = {id: dims for id, dims in moved.items() if dims}
+    if not moved:
+        return
+    fin = models.Finance
+    records = await db.execute(
+        select(fin.server_id, fin.payment_date, fin.price).where(fin.server_id.in_(moved), fin.payment_date.is_not(None))
+    )
+    deltas = defaultdict(lambda: (0.0, 0))
+    for server_id, payment_date, price in records.all():
+        month = payment_date.strftime("%Y-%m")
+        for dimension, (old, new) in moved[server_id].items():
+            _add(deltas, [((month, dimension, "" if old is None else str(old)), price or 0.0)], -1)
+            _add(deltas, [((month, dimension, "" if new is None else str(new)), price or 0.0)], +1)
+    await _apply(db, deltas)
+
+async def record_new(db, ids):
+    """Bulk variant for freshly inserted finance rows."""
+    deltas = defaultdict(lambda: (0.0, 0))
+    query = select(models.Finance).options(*loading.plan(schemas.Finance)).where(models.Finance.id.in_(ids))
+    for fin in (await db.scalars(query)).all():
+        _add(deltas, contributions(fin), +1)
+    await _apply(db, deltas)
+
+async def rebuild(db):
+    await db.execute(delete(models.FinanceRollup))
+    deltas = defaultdict(lambda: (0.0, 0))
+    query = select(models.Finance).options(*loading.plan(schemas.Finance)).execution_options(yield_per=1000)
+    async for fin in await db.stream_scalars(query):
+        _add(deltas, contributions(fin), +1)
+    await _apply(db, deltas)
+    await db.commit()
+
+async def backfill(db):
+    if await db.scalar(select(models.FinanceRollup.month).limit(1)) is None and await db.scalar(select(models.Finance.id).limit(1)) is not None:
+        await rebuild(db)
+
+async def analytics(db, since=None, until=None, dimensions=DIMENSIONS):
+    table = models.FinanceRollup
+    query = select(table).where(table.dimension.in_(dimensions)).order_by(table.month, table.dimension, table.key)
+    if since:
+        query = query.where(table.month >= since)
+    if until:
+        query = query.where(table.month <= until)
+    rows = (await db.scalars(query)).all()
+
+    # group / project keys are ids - resolve them to titles in one query each
+    titles = {}
+    for dimension, model in (("group", models.Group), ("project", models.Project)):
+        ids = {int(r.key) for r in rows if r.dimension == dimension and r.key}
+        if ids:
+            result = await db.execute(select(model.id, model.title).where(model.id.in_(ids)))
+            titles[dimension] = {str(id): title for id, title in result.all()}
+
+    monthly = {dimension: [] for dimension in dimensions}
+    totals = {dimension: defaultdict(lambda: [0.0, 0]) for dimension in dimensions}
+    for r in rows:
+        if not r.records and not r.total:
+            continue
+        label = titles.get(r.dimension, {}).get(r.key, r.key)
+        monthly[r.dimension].append({"month": r.month, "key": r.key, "label": label, "total": round(r.total, 2), "records": r.records})
+        totals[r.dimension][(r.key, label)][0] += r.total
+        totals[r.dimension][(r.key, label)][1] += r.records
+    return {
+        "monthly": monthly,
+        "totals": {
+            dimension: [{"key": key, "label": label, "total": round(t, 2), "records": n} for (key, label), (t, n) in sorted(values.items())]
+            for dimension, values in totals.items()
+        },
+    }
@@ -1,8 +1,18 @@
 from __future__ import annotations
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Any, Optional, List, Dict
 from datetime import datetime
 
+def orm_json(schema, obj) -> str:
+    # orm_mode only covers from_orm() on pydantic 1; pydantic 2 wants from_attributes explicitly
+    if hasattr(schema, "model_validate"):
+        return schema.model_validate(obj, from_attributes=True).model_dump_json()
+    return schema.from_orm(obj).json()
+
+def fields(schema) -> dict:
+    """{name: field} of a schema on pydantic 2 (model_fields) or 1 (__fields__)."""
+    return getattr(schema, "model_fields", None) or schema.__fields__
+
 class UserBase(BaseModel):
     username: str
     email: str
@@ -28,6 +38,7 @@ class History(BaseModel):
     user: str
     action: str
     changes: str
+    diff: Optional[dict] = None
     timestamp: datetime
     class Config:
         orm_mode = True
@@ -36,9 +47,19 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
+class FeedTicket(BaseModel):
+    ticket: str
+    expires_in: int
+
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+class Principal(BaseModel):
+    id: int
+    username: str
+    role: str
+    status: str
+
 class ServerBase(BaseModel):
     os: str
     ip: str
@@ -60,9 +81,40 @@ class Server(ServerBase):
     id: int
     group: Optional["Group"]
     project: Optional["Project"]
+    probe: Optional["ServerProbe"] = None
+    class Config:
+        orm_mode = True
+
+class ServerProbe(BaseModel):
+    state: str
+    latency_ms: Optional[float] = None
+    checked_at: datetime
+    last_seen: Optional[datetime] = None
     class Config:
         orm_mode = True
 
+class ProbeRequest(BaseModel):
+    ids: Optional[List[int]] = None  # all servers when omitted
+
+class ProbeStateSummary(BaseModel):
+    state: str
+    servers: int
+    avg_latency_ms: Optional[float] = None
+    max_latency_ms: Optional[float] = None
+
+class ProbeSummary(BaseModel):
+    servers: int
+    probed: int
+    states: List[ProbeStateSummary]
+    oldest_check: Optional[datetime] = None
+    newest_check: Optional[datetime] = None
+
+class ProbeRunResult(BaseModel):
+    servers: int
+    up: int
+    down: int
+    seconds: float
+
 class DomainBase(BaseModel):
     name: str
     group_id: Optional[int] = None
@@ -80,6 +132,15 @@ class Domain(DomainBase):
     class Config:
         orm_mode = True
 
+class DomainRefresh(BaseModel):
+    ids: Optional[List[int]] = None  # all domains when omitted
+
+class DomainRefreshResult(BaseModel):
+    domains: int
+    changed: int
+    failed: int
+    seconds: float
+
 class ProjectBase(BaseModel):
     title: str
 
@@ -120,3 +181,57 @@ class Finance(FinanceBase):
     server: Server
     class Config:
         orm_mode = True
+
+class BatchUpdate(BaseModel):
+    ids: Optional[List[int]] = None
+    where: Optional[Dict[str, Any]] = None  # column -> value, or a list of values
+    values: Dict[str, Any]
+
+class BatchRowResult(BaseModel):
+    id: int
+    result: str  # updated / unchanged / not_matched
+    diff: Optional[Dict[str, List[Any]]] = None
+
+class BatchUpdateResult(BaseModel):
+    matched: int
+    updated: int
+    results: List[BatchRowResult]
+
+class FinanceRollup(BaseModel):
+    key: str
+    label: Optional[str] = None
+    total: float
+    records: int
+
+class MonthlyFinanceRollup(FinanceRollup):
+    month: str
+
+class FinanceAnalytics(BaseModel):
+    monthly: Dict[str, List[MonthlyFinanceRollup]]
+    totals: Dict[str, List[FinanceRollup]]
+
+class OverviewCounts(BaseModel):
+    servers: int
+    servers_by_status: Dict[str, int]
+    domains: int
+    domains_by_status: Dict[str, int]
+    finance_total: Optional[float] = None  # null for roles without finance access
+    finance_records: Optional[int] = None
+
+class ProjectOverview(OverviewCounts):
+    id: int
+    title: str
+    groups: int
+
+class GroupOverview(OverviewCounts):
+    id: int
+    title: str
+    status: Optional[str] = None
+    project_id: Optional[int] = None
+
+class Overview(BaseModel):
+    month: str
+    totals: OverviewCounts
+    projects: List[ProjectOverview]
+    groups: List[GroupOverview]
+    unassigned: Dict[str, OverviewCounts]  # "group" / "project": rows outside any
@@ -0,0 +1,150 @@
+import sqlite3
+from typing import List
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import DDL, Index, bindparam, event, func, insert, select, text, update
+
+import database, loading, models, serialize
+
+# Every searchable entity keeps one denormalized row in search_documents: the lowercased
+# fields the `q` filter matches, including titles of the related group/project.
+# Postgres indexes it with pg_trgm (GIN), SQLite with an FTS5 trigram table, so a
+# '%q%' search never scans the entity tables.
+SEARCH_LIMIT = 200
+MIN_TRIGRAM = 3  # shorter queries cannot use a trigram index and fall back to LIKE
+
+FTS5 = sqlite3.sqlite_version_info >= (3, 34, 0)  # trigram tokenizer
+
+_table = models.SearchDocument.__table__
+
+event.listen(_table, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+Index(
+    "ix_search_documents_document_trgm", models.SearchDocument.document,
+    postgresql_using="gin", postgresql_ops={"document": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql")
+
+for ddl in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "document, content='search_documents', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_fts(rowid, document) VALUES (new.id, new.document); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, document) VALUES ('delete', old.id, old.document); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, document) VALUES ('delete', old.id, old.document); "
+    "INSERT INTO search_fts(rowid, document) VALUES (new.id, new.document); END",
+):
+    event.listen(_table, "after_create", DDL(ddl).execute_if(dialect="sqlite", callable_=lambda *a, **kw: FTS5))
+
+def _title(obj):
+    return obj.title if obj is not None else ""
+
+def _join(*fields):
+    # newline separated so a match can't run across two fields
+    return "\n".join("" if f is None else str(f) for f in fields).lower()
+
+DOCUMENTS = {
+    "server": lambda s: _join(s.id, s.ip, _title(s.project), _title(s.group)),
+    "domain": lambda d: _join(d.name, _title(d.group)),
+    "group": lambda g: _join(g.id, g.title),
+    "finance": lambda f: _join(f.id, f.server_id, f.payment_date, _title(f.server.group) if f.server else ""),
+    "user": lambda u: _join(u.username, u.email, u.number, u.role),
+}
+
+# entity type -> (model, response schema whose loading plan covers what the document reads)
+TARGETS = {t: serialize.ENTITIES[t] for t in DOCUMENTS}
+
+async def index(db, target_type: str, obj):
+    """Stages the search document of `obj` in the current transaction; `obj` must have
+    the relationships of its loading plan loaded."""
+    document = DOCUMENTS[target_type](obj)
+    doc = await db.scalar(select(models.SearchDocument).filter_by(target_type=target_type, target_id=obj.id))
+    if doc is None:
+        db.add(models.SearchDocument(target_type=target_type, target_id=obj.id, document=document))
+    elif doc.document != document:
+        doc.document = document
+
+async def index_many(db, target_type: str, objs):
+    """index() for many rows: one SELECT of their current documents, one executemany UPDATE
+    for the ones that changed and one INSERT for the missing."""
+    documents = {obj.id: DOCUMENTS[target_type](obj) for obj in objs}
+    if not documents:
+        return
+    doc = models.SearchDocument
+    existing = dict((await db.execute(
+        select(doc.target_id, doc.document).where(doc.target_type == target_type, doc.target_id.in_(list(documents)))
+    )).all())
+    changed = [{"_id": id, "_document": d} for id, d in documents.items() if id in existing and existing[id] != d]
+    missing = [dict(target_type=target_type, target_id=id, document=d) for id, d in documents.items() if id not in existing]
+    if changed:
+        await db.execute(
+            update(_table).where(_table.c.target_type == target_type, _table.c.target_id == bindparam("_id"))
+            .values(document=bindparam("_document")),
+            changed,
+        )
+    if missing:
+        await db.execute(insert(doc), missing)
+
+async def reindex(db, target_type: str, where=None):
+    model, schema = TARGETS[target_type]
+    query = select(model).options(*loading.plan(schema))
+    if where is not None:
+        query = query.where(where)
+    await index_many(db, target_type, (await db.scalars(query)).all())
+
+async def index_new(db, target_type: str, ids):
+    """Bulk variant of index() for freshly inserted rows: one SELECT and one multi-row INSERT."""
+    if not ids:
+        return
+    model, schema = TARGETS[target_type]
+    objs = (await db.scalars(select(model).options(*loading.plan(schema)).where(model.id.in_(ids)))).all()
+    docs = [dict(target_type=target_type, target_id=obj.id, document=DOCUMENTS[target_type](obj)) for obj in objs]
+    await db.execute(insert(models.SearchDocument), docs)
+
+async def reindex_group_members(db, group_id: int):
+    """Servers, domains and finance records embed their group title in the document."""
+    await reindex(db, "server", models.Server.group_id == group_id)
+    await reindex(db, "domain", models.Domain.group_id == group_id)
+    await reindex(db, "finance", models.Finance.server.has(models.Server.group_id == group_id))
+
+async def backfill(db):
+    """Builds documents for a database created before search_documents existed."""
+    if await db.scalar(select(models.SearchDocument.id).limit(1)) is not None:
+        return
+    for target_type in TARGETS:
+        await reindex(db, target_type)
+    await db.commit()
+
+def _like(q: str) -> str:
+    return "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+async def search_ids(db, target_type: str, q: str, limit: int = SEARCH_LIMIT) -> List[int]:
+    """Ids of `target_type` entities matching `q`, best match first."""
+    q = q.strip().lower()
+    dialect = database.engine.dialect.name
+    doc = models.SearchDocument
+    if dialect == "sqlite" and FTS5 and len(q) >= MIN_TRIGRAM:
+        stmt = text(
+            "SELECT d.target_id FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid "
+            "WHERE search_fts MATCH :match AND d.target_type = :target_type "
+            "ORDER BY search_fts.rank LIMIT :limit"
+        ).bindparams(match='"' + q.replace('"', '""') + '"', target_type=target_type, limit=limit)
+    else:
+        stmt = select(doc.target_id).where(doc.target_type == target_type, doc.document.ilike(_like(q), escape="\\"))
+        if dialect == "postgresql":
+            stmt = stmt.order_by(func.word_similarity(q, doc.document).desc(), doc.target_id)
+        else:
+            stmt = stmt.order_by(doc.target_id)
+        stmt = stmt.limit(limit)
+    return list((await db.scalars(stmt)).all())
+
+async def ranked_response(db, query, target_type: str, q: str, limit, shape, format=None):
+    """Runs `query` (`shape`'s select()) restricted to the top search hits for `q`, in rank order."""
+    model = TARGETS[target_type][0]
+    ids = await search_ids(db, target_type, q, limit or SEARCH_LIMIT)
+    rows = await serialize.fetch(db, shape, query.where(model.id.in_(ids)))
+    position = {id: i for i, id in enumerate(ids)}
+    rows.sort(key=lambda row: position[row["id"]])
+    if format == "ndjson":
+        return StreamingResponse((serialize.dumps(row) + b"\n" for row in rows), media_type="application/x-ndjson")
+    return rows
@@ -0,0 +1,129 @@
+import json
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException
+
+from sqlalchemy import inspect, select as sa_select
+from sqlalchemy.orm import aliased
+
+import models, schemas
+
+try:
+    import orjson
+except ImportError:  # same output, just slower
+    orjson = None
+
+# Fast path for list responses. Instead of loading ORM objects, validating each one with
+# pydantic (from_attributes) and encoding the result, a list query selects exactly the
+# columns its response schema shows - related rows through outer joins, the same SELECT
+# the loading plan would run - and each result tuple becomes a dict in the schema's field
+# order, encoded in one go. Rows come straight from our own tables, so they are not
+# re-validated. bench/serialization.py checks the output matches the pydantic path.
+
+# entity type -> (model, response schema); search, feed and bulk take theirs from here
+ENTITIES = {
+    "server": (models.Server, schemas.Server),
+    "domain": (models.Domain, schemas.Domain),
+    "group": (models.Group, schemas.Group),
+    "project": (models.Project, schemas.Project),
+    "finance": (models.Finance, schemas.Finance),
+    "user": (models.User, schemas.User),
+}
+
+# response schema -> model it is read from
+MODELS = {schema: model for model, schema in ENTITIES.values()}
+MODELS[schemas.History] = models.History
+
+# model -> schema used when the model appears nested in another response
+NESTED = {model: schema for model, schema in ENTITIES.values()}
+NESTED[models.ServerProbe] = schemas.ServerProbe
+
+class Shape:
+    """Flat column list + outer joins for `schema`, and the function turning one result row
+    back into the nested dict pydantic would produce. `only` limits the top level to those
+    fields; relationships left out are neither joined nor selected."""
+
+    def __init__(self, schema, model, only=None):
+        self.model = model
+        self.columns = []
+        self.joins = []
+        self.build = self._compile(schema, model, model, only)
+
+    def _compile(self, schema, model, entity, only=None):
+        relationships = inspect(model).relationships
+        parts = []
+        for name in schemas.fields(schema):
+            if only is not None and name not in only:
+                continue
+            if name in relationships:
+                target = relationships[name].mapper.class_
+                alias = aliased(target)
+                self.joins.append((alias, getattr(entity, name).of_type(alias)))
+                present = len(self.columns)
+                # primary key, NULL when there is no related row
+                self.columns.append(getattr(alias, inspect(target).primary_key[0].key))
+                parts.append((name, present, self._compile(NESTED[target], target, alias)))
+            else:
+                parts.append((name, len(self.columns), None))
+                self.columns.append(getattr(entity, name))
+
+        def build(row):
+            out = {}
+            for name, index, nested in parts:
+                if nested is None:
+                    out[name] = row[index]
+                else:
+                    out[name] = nested(row) if row[index] is not None else None
+            return out
+        return build
+
+    def select(self):
+        query = sa_select(*self.columns).select_from(self.model)
+        for alias, onclause in self.joins:
+            query = query.outerjoin(alias, onclause)
+        return query
+
+@lru_cache(maxsize=256)  # bounded: `only` comes from the query string
+def shape(schema, model=None, only: Optional[frozenset] = None) -> Shape:
+    """Shape of `schema`; select() gives its SELECT - filter and order it on the model's
+    columns as usual. `model` swaps in a table with the same columns (HistoryArchive for
+    History), `only` is a projection()."""
+    return Shape(schema, model or MODELS[schema], only)
+
+def build(shape: Shape, rows):
+    make = shape.build
+    return [make(row) for row in rows]
+
+async def fetch(db, shape: Shape, query):
+    return build(shape, (await db.execute(query)).all())
+
+def _names(value: str):
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+def projection(schema, fields: Optional[str] = None, include: Optional[str] = None) -> Optional[frozenset]:
+    """Top-level fields to return for ?fields=a,b&include=rel. `fields` picks fields (id is
+    always kept, the cursor needs it) and leaves relationships out unless it or `include`
+    names them; `include` alone keeps every column. None when neither is given - the full
+    schema."""
+    if fields is None and include is None:
+        return None
+    relationships = inspect(MODELS[schema]).relationships
+    every = set(schemas.fields(schema))
+    picked = {name for name in every if name not in relationships} if fields is None else _names(fields) | {"id"}
+    joined = set() if include is None else _names(include)
+    unknown = sorted((picked - every) | (joined - (every & set(relationships.keys()))))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown field: {', '.join(unknown)}")
+    return frozenset(picked | joined)
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode()
@@ -0,0 +1,48 @@
+import asyncio
+
+import metrics
+
+# Single-flight: while a call for some key is running, further calls for the same key
+# wait for it and share its result (or exception) instead of running again. Nothing is
+# kept once the call finishes - that is the response cache's job - so only requests
+# that actually overlap are collapsed. Per worker, like the other in-process caches.
+
+calls = metrics.Counter("singleflight_calls_total", "Coalescable calls by route and whether they ran (leader) or shared another's result (shared).", ("route", "result"))
+
+class Group:
+    def __init__(self, name: str):
+        self._flights = {}
+        metrics.Gauge(f"singleflight_{name}_in_flight", f"Distinct {name} calls currently running.", lambda: len(self._flights))
+
+    async def do(self, key, fn, route: str = ""):
+        """Result of `await fn()`, run at most once at a time per `key`."""
+        while True:
+            future = self._flights.get(key)
+            if future is None:
+                break
+            calls.inc(route, "shared")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this caller went away
+                # the leader was cancelled before finishing; try again
+
+        future = asyncio.get_running_loop().create_future()
+        # retrieved here so a failure nobody else waited for isn't logged as unhandled
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._flights[key] = future
+        calls.inc(route, "leader")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
@@ -0,0 +1,54 @@
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+import database, models
+
+# Every transaction that writes to a table also increments that table's row in
+# table_versions before it commits, so readers in any worker can tell whether a
+# cached list is still current with a single primary-key lookup.
+_TOUCHED = "touched_tables"
+_VERSIONS = models.TableVersion.__table__.name
+
+def _tables_of(objects):
+    return {obj.__table__.name for obj in objects if hasattr(obj, "__table__")}
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statements(state):
+    # bulk INSERT/UPDATE/DELETE statements bypass session.new/dirty
+    if state.is_insert or state.is_update or state.is_delete:
+        table = state.statement.table.name
+        if table != _VERSIONS:
+            state.session.info.setdefault(_TOUCHED, set()).add(table)
+
+@event.listens_for(Session, "before_flush")
+def _track_flush(session, flush_context, instances):
+    tables = _tables_of(session.new) | _tables_of(session.dirty) | _tables_of(session.deleted)
+    if tables:
+        session.info.setdefault(_TOUCHED, set()).update(tables)
+
+@event.listens_for(Session, "before_commit")
+def _bump(session):
+    tables = session.info.pop(_TOUCHED, set()) | _tables_of(session.new) | _tables_of(session.dirty) | _tables_of(session.deleted)
+    tables.discard(_VERSIONS)
+    if tables:
+        session.execute(
+            update(models.TableVersion).where(models.TableVersion.name.in_(sorted(tables)))
+            .values(version=models.TableVersion.version + 1)
+        )
+        database.note_write()
+        session.info.pop(_TOUCHED, None)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget(session, previous_transaction):
+    session.info.pop(_TOUCHED, None)
+
+async def seed(db):
+    existing = set((await db.scalars(select(models.TableVersion.name))).all())
+    missing = [name for name in database.Base.metadata.tables if name not in existing]
+    if missing:
+        await db.execute(insert(models.TableVersion), [{"name": name, "version": 0} for name in missing])
+        await db.commit()
+
+async def current(db, tables) -> dict:
+    rows = await db.execute(select(models.TableVersion.name, models.TableVersion.version).where(models.TableVersion.name.in_(tables)))
+    return dict(rows.all())
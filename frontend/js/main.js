@@ -5,11 +5,15 @@ const api = {
         const token = localStorage.getItem('cn_token');
         const headers = { 'Content-Type': 'application/json' };
         if (token) headers['Authorization'] = `Bearer ${token}`;
+        // handed back after our writes; sent along, our next reads skip lagging replicas
+        const lastWrite = localStorage.getItem('cn_last_write');
+        if (lastWrite) headers['X-Last-Write'] = lastWrite;
 
         const config = { method, headers };
         if (body) config.body = JSON.stringify(body);
 
         const response = await fetch(`${API_URL}${endpoint}`, config);
+        if (response.headers.get('X-Last-Write')) localStorage.setItem('cn_last_write', response.headers.get('X-Last-Write'));
 
         if (response.status === 401) {
             app.logout();
@@ -27,6 +31,10 @@ const api = {
 const app = {
     currentPage: 'servers',
     dataCache: {},
+    searchTimer: null,
+    rows: [],
+    query: '',
+    feed: null,
 
     init() {
         this.neuralBg();
@@ -78,22 +86,87 @@ const app = {
         };
         document.querySelectorAll('.nav-links li').forEach(li => li.onclick = () => this.navigate(li.dataset.page));
         document.querySelector('.btn-add').onclick = () => this.openAddModal();
-        document.getElementById('main-search').oninput = (e) => this.search(e.target.value.toLowerCase());
+        document.getElementById('main-search').oninput = (e) => {
+            clearTimeout(this.searchTimer);
+            this.searchTimer = setTimeout(() => this.search(e.target.value.toLowerCase()), 250);
+        };
     },
 
     async search(q) {
         if (this.currentPage === 'settings') return;
-        const data = await api.request(`/api/${this.currentPage}?q=${q}`);
-        this.renderTable(this.currentPage, data);
+        this.query = q;
+        this.rows = await api.request(q ? `/api/${this.currentPage}?q=${encodeURIComponent(q)}` : `/api/${this.currentPage}`);
+        this.renderTable(this.currentPage, this.rows);
     },
 
     showInterface() {
         document.getElementById('login-page').classList.remove('active');
         document.getElementById('main-interface').classList.add('active');
         this.navigate('servers');
+        this.connectFeed();
+    },
+
+    // Live changes from other operators (and our own) patch the rows on screen instead of
+    // reloading the whole list.
+    // The stream is opened with a short-lived ticket rather than the access token, which
+    // would end up in access logs; once the browser gives up on a ticket we fetch another.
+    async connectFeed(reconnecting = false) {
+        if (this.feed) this.feed.close();
+        this.feed = null;
+        let ticket;
+        try {
+            ticket = await api.request('/api/changes/ticket', 'POST');
+        } catch (e) {
+            return;
+        }
+        if (!ticket) return;  // logged out
+        const feed = this.feed = new EventSource(`${API_URL}/api/changes?ticket=${encodeURIComponent(ticket.ticket)}`);
+        feed.onopen = () => {
+            // changes made while we were disconnected never arrive: reload what is shown
+            if (reconnecting) this.refresh();
+            reconnecting = true;
+        };
+        feed.onerror = () => {
+            if (feed.readyState !== EventSource.CLOSED) return;  // the browser retries by itself
+            setTimeout(() => { if (this.feed === feed) this.connectFeed(true); }, 3000);
+        };
+        feed.addEventListener('change', (e) => this.applyChange(JSON.parse(e.data)));
+    },
+
+    refresh() {
+        if (this.currentPage === 'settings') return;
+        if (this.query) this.search(this.query);
+        else this.navigate(this.currentPage);
+    },
+
+    applyChange(change) {
+        if (this.currentPage === 'settings') return;
+        if (change.type === this.targetType(this.currentPage)) {
+            // imports (and rows too big to send) only say that something changed
+            if (!change.data) return this.refresh();
+            const i = this.rows.findIndex(r => r.id === change.id);
+            if (i >= 0) this.rows[i] = change.data;
+            else if (change.action === 'Created' && !this.query) this.rows.push(change.data);
+            else return;
+        } else if (this.overview && ['server', 'domain', 'finance'].includes(change.type)) {
+            // counts on the groups / projects pages; cached server-side, so this is cheap
+            return this.loadOverview(this.currentPage).then(() => this.renderTable(this.currentPage, this.rows));
+        } else {
+            // a renamed group / project / server is embedded in the rows that reference it
+            const embedding = this.rows.filter(r => change.data && r[change.type] && r[change.type].id === change.id);
+            if (!embedding.length) return;
+            embedding.forEach(r => r[change.type] = change.data);
+        }
+        this.renderTable(this.currentPage, this.rows);
+    },
+
+    targetType(page) {
+        // pages are plural ('servers'), entity / history target types singular ('server')
+        return page === 'finance' ? page : page.replace(/s$/, '');
     },
 
     logout() {
+        if (this.feed) { this.feed.close(); this.feed = null; }
         localStorage.removeItem('cn_token');
         document.getElementById('login-page').classList.add('active');
         document.getElementById('main-interface').classList.remove('active');
@@ -111,8 +184,24 @@ const app = {
             return;
         }
 
-        const data = await api.request(`/api/${page}`);
-        this.renderTable(page, data);
+        this.query = '';
+        [this.rows] = await Promise.all([api.request(`/api/${page}`), this.loadOverview(page)]);
+        this.renderTable(page, this.rows);
+    },
+
+    // server / domain counts and this month's spend per group or project (GET /api/overview)
+    async loadOverview(page) {
+        this.overview = null;
+        if (page !== 'groups' && page !== 'projects') return;
+        const data = await api.request('/api/overview');
+        this.overview = Object.fromEntries(data[page].map(o => [o.id, o]));
+    },
+
+    overviewCells(id) {
+        const o = (this.overview || {})[id];
+        if (!o) return '<td></td><td></td><td></td>';
+        const breakdown = (byStatus) => Object.entries(byStatus).map(([s, n]) => `${s || '-'}: ${n}`).join(', ');
+        return `<td title="${breakdown(o.servers_by_status)}">${o.servers}</td><td title="${breakdown(o.domains_by_status)}">${o.domains}</td><td>${o.finance_total === null ? '' : o.finance_total}</td>`;
     },
 
     renderTable(page, data) {
@@ -121,16 +210,16 @@ const app = {
 
         switch(page) {
             case 'servers':
-                headers = "<th>ID</th><th>OS</th><th>IP</th><th>Additional IP</th><th>Hoster</th><th>Status</th><th>Group</th><th>Project</th><th>Country</th><th>Comments</th><th>Action</th>";
-                rows = data.map(i => `<tr><td>${i.id}</td><td>${i.os}</td><td>${i.ip}</td><td>${i.additional_ip || ''}</td><td>${i.hoster}</td><td>${i.status}</td><td>${i.group ? i.group.title : ''}</td><td>${i.project ? i.project.title : ''}</td><td>${i.country}</td><td>${i.comments || ''}</td><td><button class="action-btn" onclick="app.openMenu('${page}', ${i.id})">⋮</button></td></tr>`).join('');
+                headers = "<th>ID</th><th>OS</th><th>IP</th><th>Additional IP</th><th>Hoster</th><th>Status</th><th>Group</th><th>Project</th><th>Country</th><th>Comments</th><th>SSH</th><th>Action</th>";
+                rows = data.map(i => `<tr><td>${i.id}</td><td>${i.os}</td><td>${i.ip}</td><td>${i.additional_ip || ''}</td><td>${i.hoster}</td><td>${i.status}</td><td>${i.group ? i.group.title : ''}</td><td>${i.project ? i.project.title : ''}</td><td>${i.country}</td><td>${i.comments || ''}</td><td>${i.probe ? (i.probe.state === 'up' ? `${Math.round(i.probe.latency_ms)} ms` : i.probe.state) : ''}</td><td><button class="action-btn" onclick="app.openMenu('${page}', ${i.id})">⋮</button></td></tr>`).join('');
                 break;
             case 'domains':
                 headers = "<th>ID</th><th>Domain</th><th>Group</th><th>Status</th><th>NS</th><th>A Record</th><th>AAAA Record</th><th>Action</th>";
                 rows = data.map(i => `<tr><td>${i.id}</td><td>${i.name}</td><td>${i.group ? i.group.title : ''}</td><td>${i.status}</td><td>${i.ns || ''}</td><td>${i.a_record || ''}</td><td>${i.aaaa_record || ''}</td><td><button class="action-btn" onclick="app.openMenu('${page}', ${i.id})">⋮</button></td></tr>`).join('');
                 break;
             case 'projects':
-                headers = "<th>ID</th><th>Title</th><th>Action</th>";
-                rows = data.map(i => `<tr><td>${i.id}</td><td>${i.title}</td><td><button class="action-btn" onclick="app.openMenu('${page}', ${i.id})">⋮</button></td></tr>`).join('');
+                headers = "<th>ID</th><th>Title</th><th>Servers</th><th>Domains</th><th>Spend (month)</th><th>Action</th>";
+                rows = data.map(i => `<tr><td>${i.id}</td><td>${i.title}</td>${this.overviewCells(i.id)}<td><button class="action-btn" onclick="app.openMenu('${page}', ${i.id})">⋮</button></td></tr>`).join('');
                 break;
             case 'finance':
                 headers = "<th>ID</th><th>Server ID</th><th>Server IP</th><th>Price</th><th>Status</th><th>Payment Date</th><th>Action</th>";
@@ -141,8 +230,8 @@ const app = {
                 rows = data.map(i => `<tr><td>${i.id}</td><td>${i.username}</td><td>${i.email}</td><td>${i.role}</td><td>${i.status}</td><td>${i.number || ''}</td><td>${i.ip || ''}</td><td><button class="action-btn" onclick="app.openMenu('${page}', ${i.id})">⋮</button></td></tr>`).join('');
                 break;
             case 'groups':
-                headers = "<th>ID</th><th>Title</th><th>Project</th><th>Status</th><th>Description</th><th>Action</th>";
-                rows = data.map(i => `<tr><td>${i.id}</td><td>${i.title}</td><td>${i.project ? i.project.title : ''}</td><td>${i.status}</td><td>${i.description || ''}</td><td><button class="action-btn" onclick="app.openMenu('${page}', ${i.id})">⋮</button></td></tr>`).join('');
+                headers = "<th>ID</th><th>Title</th><th>Project</th><th>Status</th><th>Description</th><th>Servers</th><th>Domains</th><th>Spend (month)</th><th>Action</th>";
+                rows = data.map(i => `<tr><td>${i.id}</td><td>${i.title}</td><td>${i.project ? i.project.title : ''}</td><td>${i.status}</td><td>${i.description || ''}</td>${this.overviewCells(i.id)}<td><button class="action-btn" onclick="app.openMenu('${page}', ${i.id})">⋮</button></td></tr>`).join('');
                 break;
         }
         
@@ -244,9 +333,9 @@ const app = {
     },
 
     async getSelectOptions(type, selectedId, displayField = 'title') {
-        if (!this.dataCache[type]) {
-            this.dataCache[type] = await api.request(`/api/${type}`);
-        }
+        // always revalidate: lists carry an ETag, so an unchanged list comes back as a cheap 304
+        // that the browser answers from its cache; only id and label are fetched
+        this.dataCache[type] = await api.request(`/api/${type}?fields=id,${displayField}`);
         return this.dataCache[type].map(o => `<option value="${o.id}" ${o.id === selectedId ? 'selected' : ''}>${o[displayField] || o.title || o.name}</option>`).join('');
     },
 
@@ -256,14 +345,16 @@ const app = {
 
     async saveUpdate(type, id) {
         const payload = this.getPayloadFromForm(type);
-        await api.request(`/api/${type}/${id}`, 'PUT', payload);
-        this.closeModal(); this.navigate(type);
+        const saved = await api.request(`/api/${type}/${id}`, 'PUT', payload);
+        this.closeModal();
+        if (type === this.currentPage) this.applyChange({ type: this.targetType(type), id, action: 'Updated', data: saved });
     },
 
     async saveNew() {
         const payload = this.getPayloadFromForm(this.currentPage);
-        await api.request(`/api/${this.currentPage}`, 'POST', payload);
-        this.closeModal(); this.navigate(this.currentPage);
+        const saved = await api.request(`/api/${this.currentPage}`, 'POST', payload);
+        this.closeModal();
+        this.applyChange({ type: this.targetType(this.currentPage), id: saved.id, action: 'Created', data: saved });
     },
 
     async saveSettings() {
@@ -298,7 +389,7 @@ const app = {
     },
 
     async openHistory(type, id) {
-        const logs = await api.request(`/api/history/${type}/${id}`);
+        const logs = await api.request(`/api/history/${this.targetType(type)}/${id}`);
         let list = logs.map(l => `<div style="padding:10px; border-bottom:1px solid #444"><small>${new Date(l.timestamp).toLocaleString()} | User: ${l.user}</small><br><b>${l.action}:</b> ${l.changes}</div>`).join('');
         this.showModal("History Logs", `<div class="history-list">${list || "No history"}</div>`);
     },